@@ -1,19 +1,114 @@
 """Flask application."""
+import gc
+import logging
 import urllib.parse
+import os
 import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
-from flask import Flask, render_template, request, Markup
+from flask import Flask, Response, g, render_template, request, Markup, jsonify
 
-from wikidit.mw import get_page
-from wikidit.models import Featurizer, predict_page_edits, load_model
-from wikidit.preprocessing import WP10_LABELS
+from wikidit import metrics
+from wikidit.batching import BatchedModel
+from wikidit.cache import make_cache
+from wikidit.mw import get_page, get_pages, valid_title
+from wikidit.models import (
+    Featurizer, predict_page_edits, get_model, get_model_version,
+    score_page_revisions)
+from wikidit.preprocessing import WP10_LABELS, get_backlog_table, get_nlp
+from wikidit.utils import lazy
 
 app = Flask(__name__)
 
+logger = logging.getLogger(__name__)
 
-# Load instances that should only be loaded once
-MODEL = load_model()
-featurizer = Featurizer()
+# The model, NLP pipeline, and backlog tables are loaded on first use.
+# Revisions larger than WIKIDIT_MAX_BYTES are featurized approximately, as
+# are revisions which are still being featurized WIKIDIT_TIME_BUDGET seconds
+# after parsing starts. The budget cannot interrupt the parse itself.
+MAX_BYTES = os.environ.get("WIKIDIT_MAX_BYTES")
+TIME_BUDGET = os.environ.get("WIKIDIT_TIME_BUDGET")
+featurizer = Featurizer(
+    max_bytes=int(MAX_BYTES) if MAX_BYTES else None,
+    time_budget=float(TIME_BUDGET) if TIME_BUDGET else None,
+)
+approximate_featurizer = Featurizer(max_bytes=0)
+
+# Seconds to wait for a prediction before returning an approximate one. The
+# exact prediction continues in the background and is cached when done. At
+# most WIKIDIT_FEATURIZE_WORKERS exact predictions run at once in each
+# worker; while they are all busy, approximate predictions are returned
+# without waiting.
+FEATURIZE_TIMEOUT = os.environ.get("WIKIDIT_FEATURIZE_TIMEOUT")
+FEATURIZE_TIMEOUT = float(FEATURIZE_TIMEOUT) if FEATURIZE_TIMEOUT else None
+FEATURIZE_WORKERS = int(os.environ.get("WIKIDIT_FEATURIZE_WORKERS", 2))
+_executor = None
+_executor_slots = None
+
+# Predictions cached by revision id and the version of the model and
+# featurizer, see cache_key. Set WIKIDIT_CACHE_PATH to share the cache
+# between workers.
+CACHE_TTL = os.environ.get("WIKIDIT_CACHE_TTL")
+CACHE = make_cache(
+    os.environ.get("WIKIDIT_CACHE_PATH"),
+    maxsize=int(os.environ.get("WIKIDIT_CACHE_SIZE", 1024)),
+    ttl=float(CACHE_TTL) if CACHE_TTL else None,
+)
+
+# Set WIKIDIT_METRICS to collect the metrics served at /metrics, and
+# WIKIDIT_SERVER_TIMING to also send the time of each stage of a request in
+# a Server-Timing header.
+SERVER_TIMING = bool(os.environ.get("WIKIDIT_SERVER_TIMING"))
+if SERVER_TIMING:
+    metrics.enable()
+
+
+# Set WIKIDIT_BATCH_WAIT_MS to score the pages of concurrent requests in
+# each worker, e.g. with gunicorn --threads, together. Calls to the model wait
+# that many milliseconds for others, or until there are WIKIDIT_BATCH_ROWS rows.
+BATCH_WAIT_MS = os.environ.get("WIKIDIT_BATCH_WAIT_MS")
+BATCH_ROWS = int(os.environ.get("WIKIDIT_BATCH_ROWS", 1024))
+_scoring_model = None
+
+# Maximum number of titles scored by a request to /api/score. Larger lists can
+# be scored with wikidit.scripts.score_titles.
+MAX_TITLES = int(os.environ.get("WIKIDIT_MAX_TITLES", 100))
+
+# Set WIKIDIT_SERVICE to the socket of a wikidit.service.FeaturizeService to
+# featurize and score pages there rather than in each worker.
+service = None
+if os.environ.get("WIKIDIT_SERVICE"):
+    from wikidit.service import ServiceClient
+
+    SERVICE_AUTHKEY = os.environ.get("WIKIDIT_SERVICE_AUTHKEY")
+    service = ServiceClient(
+        os.environ["WIKIDIT_SERVICE"],
+        authkey=SERVICE_AUTHKEY.encode() if SERVICE_AUTHKEY else None,
+    )
+
+
+def preload():
+    """Load the model, NLP pipeline, and backlog tables.
+
+    With ``gunicorn --preload`` this runs once in the master process and the
+    forked workers share these objects copy-on-write. Nothing is loaded if
+    pages are featurized and scored by the service.
+    """
+    if service is not None:
+        return
+    get_model()
+    get_nlp()
+    get_backlog_table()
+    # Move everything loaded so far out of the garbage collector's reach so
+    # that collections in the workers do not touch, and copy, shared pages.
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+
+if os.environ.get("WIKIDIT_PRELOAD"):
+    preload()
 
 
 def wikipedia_url(title, lang="en", revid=None):
@@ -64,6 +159,129 @@ QA = {
 }
 
 
+def scoring_model():
+    """Return the model used to score pages, batched if ``BATCH_WAIT_MS`` is set."""
+    global _scoring_model
+    if _scoring_model is None:
+        model = get_model()
+        if BATCH_WAIT_MS:
+            model = BatchedModel(
+                model, max_wait=float(BATCH_WAIT_MS) / 1000, max_rows=BATCH_ROWS)
+        _scoring_model = model
+    return _scoring_model
+
+
+def predict_content(content, approximate=False):
+    """Predict the quality and edits of the content of a revision."""
+    if service is not None:
+        return service.predict(content, approximate)
+    result = predict_page_edits(
+        content, approximate_featurizer if approximate else featurizer, scoring_model())
+    # Only keep what is needed to render the results
+    return {k: result[k] for k in ('prob', 'score', 'top_edits', 'best', 'approximate')}
+
+
+@lazy
+def prediction_version():
+    """Version of the model and featurizer which predict pages.
+
+    Cached predictions made by another version, e.g. in a cache shared with
+    workers of a previous deployment, are not used. The version of the
+    service is only asked for once, so restart the app with the service.
+    """
+    if service is not None:
+        return service.version()
+    return f"{get_model_version()}-{featurizer.version}"
+
+
+def cache_key(revid):
+    """Key of the prediction of a revision in ``CACHE``."""
+    return f"{prediction_version()}:{revid}"
+
+
+def cache_result(revid, future):
+    """Cache the result of a finished prediction unless it is approximate."""
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logger.error(f"Prediction of revision {revid} failed: {future.exception()!r}")
+        return
+    result = future.result()
+    if not result['approximate']:
+        CACHE.set(cache_key(revid), result)
+
+
+def _get_executor():
+    # Created on first use, since threads do not survive gunicorn forking
+    # the workers of a preloaded app.
+    global _executor, _executor_slots
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FEATURIZE_WORKERS)
+        _executor_slots = threading.BoundedSemaphore(FEATURIZE_WORKERS)
+    return _executor
+
+
+def _submit_exact(content):
+    """Predict ``content`` in the executor, or return ``None`` if it is busy.
+
+    Predictions are only submitted to a free thread, so none wait behind
+    revisions which are still being featurized after timing out.
+    """
+    executor = _get_executor()
+    if not _executor_slots.acquire(blocking=False):
+        return None
+    try:
+        # The stages timed in the executor are sent in Server-Timing too
+        future = executor.submit(metrics.bind_request(predict_content), content)
+    except BaseException:
+        _executor_slots.release()
+        raise
+    future.add_done_callback(lambda f: _executor_slots.release())
+    return future
+
+
+def predict_revision(page):
+    """Predict the quality and edits of a page, cached by revision id.
+
+    If ``FEATURIZE_TIMEOUT`` is set and the prediction takes longer, or all
+    ``FEATURIZE_WORKERS`` threads are busy, an approximate prediction is
+    returned instead.
+    """
+    result = CACHE.get(cache_key(page['revid']))
+    if result is not None:
+        return result
+    if FEATURIZE_TIMEOUT is None:
+        result = predict_content(page['content'])
+    else:
+        future = _submit_exact(page['content'])
+        if future is None:
+            logger.warning(f"No thread free to predict revision {page['revid']}")
+            return predict_content(page['content'], approximate=True)
+        try:
+            result = future.result(timeout=FEATURIZE_TIMEOUT)
+        except TimeoutError:
+            logger.warning(f"Prediction of revision {page['revid']} timed out")
+            future.add_done_callback(lambda f: cache_result(page['revid'], f))
+            return predict_content(page['content'], approximate=True)
+    if not result['approximate']:
+        CACHE.set(cache_key(page['revid']), result)
+    return result
+
+
+def results_data(page, result):
+    """Create the variables for the results template."""
+    data = {
+        'title': page['title'],
+        'wikipedia_url': wikipedia_url(page['title']),
+    }
+    data['probs'] = reversed([{'prob': round(p * 100), **QA[k]} for k, p in result['prob']])
+    data['edits'] = [{'description': Markup(x[1]), 'value': round(x[2] * 100)}
+                     for x in result['top_edits'] if x[2] > 0.005]
+    data['best'] = QA[result['best']]
+    data['approximate'] = result.get('approximate', False)
+    return data
+
+
 @app.route('/page')
 def wiki():
     title = request.args.get('page-title')
@@ -73,18 +291,98 @@ def wiki():
     page = get_page(title)
     if page is None:
         return render_template("not_found.html", title=title)
-    data = {
-        'title': page['title'],
-        'wikipedia_url': wikipedia_url(page['title']),
-    }
-    result = predict_page_edits(page['content'], featurizer, MODEL)
-    data['probs'] = reversed([{'prob': round(p * 100), **QA[k]} for k, p in result['prob']])
-    data['edits'] = [{'description': Markup(x[1]), 'value': round(x[2] * 100)}
-                     for x in result['top_edits'] if x[2] > 0.005]
-    data['best'] = QA[result['best']]
+    data = results_data(page, predict_revision(page))
     return render_template("results.html", **data)
 
 
+def score_pages(titles, pages=None):
+    """Predict the quality of the current revisions of pages.
+
+    ``pages`` are the revisions of ``titles`` from
+    :func:`wikidit.mw.get_pages`. If ``None``, they are retrieved.
+    """
+    if pages is None:
+        pages = get_pages(titles)
+    if service is not None:
+        return score_page_revisions(titles, pages, scorer=service.score_revisions)
+    return score_page_revisions(titles, pages, scoring_model())
+
+
+def parse_titles(body):
+    """Return the list of titles in a JSON request body.
+
+    Raises ``ValueError`` if the body is not ``{"titles": [...]}`` with at
+    most ``MAX_TITLES`` valid titles.
+    """
+    titles = body.get('titles') if isinstance(body, dict) else None
+    if not (isinstance(titles, list) and all(isinstance(t, str) for t in titles)):
+        raise ValueError('"titles" must be a list of strings')
+    if len(titles) > MAX_TITLES:
+        raise ValueError(f'At most {MAX_TITLES} titles can be scored at once')
+    invalid = [t for t in titles if not valid_title(t)]
+    if invalid:
+        raise ValueError(f'Invalid titles: {", ".join(map(repr, invalid))}')
+    return titles
+
+
+@app.route('/api/score', methods=['POST'])
+def api_score():
+    """Score many pages given as JSON: ``{"titles": [...]}``."""
+    try:
+        titles = parse_titles(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': score_pages(titles)})
+
+
+@app.route('/cache')
+def cache_stats():
+    return jsonify(CACHE.stats())
+
+
+@app.before_request
+def start_timing():
+    if metrics.ENABLED:
+        g.start_time = time.perf_counter()
+        metrics.start_request()
+
+
+@app.after_request
+def end_timing(response):
+    if metrics.ENABLED and 'start_time' in g:
+        elapsed = time.perf_counter() - g.start_time
+        timings = metrics.end_request()
+        metrics.observe('wikidit_request_seconds', elapsed,
+                        endpoint=request.endpoint or 'none')
+        if SERVER_TIMING:
+            timings['total'] = elapsed
+            response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+
+def cache_metrics():
+    """Metrics of the prediction cache, for :func:`wikidit.metrics.render`."""
+    stats = CACHE.stats()
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'wikidit_cache_hits_total': (
+            'counter', 'Prediction cache hits.', stats['hits']),
+        'wikidit_cache_misses_total': (
+            'counter', 'Prediction cache misses.', stats['misses']),
+        'wikidit_cache_hit_ratio': (
+            'gauge', 'Fraction of cache lookups which were hits.',
+            stats['hits'] / lookups if lookups else 0),
+        'wikidit_cache_entries': (
+            'gauge', 'Entries in the prediction cache.', stats['size']),
+    }
+
+
+@app.route('/metrics')
+def metrics_text():
+    return Response(metrics.render(cache_metrics()),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/about')
 def about():
     return render_template("about.html")
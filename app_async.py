@@ -0,0 +1,189 @@
+"""Asynchronous web application.
+
+This serves the same pages as the Flask application in ``app.py``. Requests
+to the MediaWiki API do not block, and featurization and scoring run in a
+bounded pool of processes, so a single server process can serve many
+concurrent users. Run it with
+
+    gunicorn app_async:app --worker-class aiohttp.GunicornWebWorker
+
+"""
+import asyncio
+import os
+import os.path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from aiohttp import web
+
+import app as wsgi
+from wikidit import metrics
+from wikidit.cache import SQLiteRevisionCache
+from wikidit.mw import AsyncSession, get_page_async, get_pages_async
+
+EXECUTOR_WORKERS = int(os.environ.get("WIKIDIT_EXECUTOR_WORKERS", os.cpu_count() or 1))
+"""Number of processes used to featurize and score revisions, or of threads
+waiting for the service if ``WIKIDIT_SERVICE`` is set."""
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def render(request, template, status=200, **context):
+    """Render a template of the Flask application."""
+
+    def url_for(endpoint, **values):
+        # Routes are named after the endpoints of the Flask application
+        return str(request.app.router[endpoint].url_for(**values))
+
+    html = wsgi.app.jinja_env.get_template(template).render(url_for=url_for, **context)
+    return web.Response(text=html, status=status, content_type="text/html")
+
+
+async def call_cache(func, *args):
+    """Call a function which uses the prediction cache without blocking.
+
+    A cache in a SQLite file, see ``WIKIDIT_CACHE_PATH``, is used in a thread
+    of the default executor, since it reads and writes the file.
+    """
+    if isinstance(wsgi.CACHE, SQLiteRevisionCache):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+    return func(*args)
+
+
+def cache_later(revid, future):
+    """Cache the result of a prediction when it finishes, without blocking."""
+
+    def callback(f):
+        asyncio.ensure_future(call_cache(wsgi.cache_result, revid, f))
+
+    future.add_done_callback(callback)
+
+
+async def index(request):
+    return render(request, "index.html")
+
+
+async def wiki(request):
+    title = request.query.get("page-title")
+    # if an empty title, return the original index
+    if title is None or title.strip() == "":
+        return render(request, "index.html")
+    page = await get_page_async(title, request.app["session"])
+    if page is None:
+        return render(request, "not_found.html", title=title)
+    result = await call_cache(wsgi.CACHE.get, wsgi.cache_key(page["revid"]))
+    if result is None:
+        loop = asyncio.get_event_loop()
+        executor = request.app["executor"]
+        timed_out = request.app["timed_out"]
+        # Slow revisions which timed out may occupy the executor, so another
+        # exact prediction is not queued behind too many of them.
+        exact = len(timed_out) < wsgi.FEATURIZE_WORKERS
+        if exact:
+            future = loop.run_in_executor(
+                executor, wsgi.predict_content, page["content"]
+            )
+            try:
+                # Shielded, so the prediction continues and is cached on a
+                # timeout
+                result = await asyncio.wait_for(
+                    asyncio.shield(future), wsgi.FEATURIZE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                exact = False
+                timed_out.add(future)
+                future.add_done_callback(timed_out.discard)
+                cache_later(page["revid"], future)
+            else:
+                await call_cache(wsgi.cache_result, page["revid"], future)
+        if not exact:
+            result = await loop.run_in_executor(
+                executor, wsgi.predict_content, page["content"], True
+            )
+    return render(request, "results.html", **wsgi.results_data(page, result))
+
+
+async def api_score(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    try:
+        titles = wsgi.parse_titles(body)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    # Only featurization and scoring run in the executor
+    pages = await get_pages_async(titles, request.app["session"])
+    loop = asyncio.get_event_loop()
+    results = await loop.run_in_executor(
+        request.app["executor"], wsgi.score_pages, titles, pages
+    )
+    return web.json_response({"results": results})
+
+
+async def cache_stats(request):
+    return web.json_response(await call_cache(wsgi.CACHE.stats))
+
+
+async def metrics_text(request):
+    # Featurization and scoring run in other processes, so only the
+    # MediaWiki requests and the cache are measured here.
+    cache_metrics = await call_cache(wsgi.cache_metrics)
+    return web.Response(text=metrics.render(cache_metrics), content_type="text/plain")
+
+
+async def about(request):
+    return render(request, "about.html")
+
+
+@web.middleware
+async def not_found(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        return render(request, "404.html", status=404)
+
+
+def _init_executor_process():
+    # Each process scores one request at a time, so WIKIDIT_BATCH_WAIT_MS
+    # would only add latency to every model call.
+    wsgi.BATCH_WAIT_MS = None
+
+
+async def on_startup(app):
+    app["session"] = AsyncSession()
+    # Exact predictions which are still running after WIKIDIT_FEATURIZE_TIMEOUT
+    app["timed_out"] = set()
+    if wsgi.service is not None:
+        # Only waits for the service, which does the work
+        app["executor"] = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+    else:
+        app["executor"] = ProcessPoolExecutor(
+            max_workers=EXECUTOR_WORKERS, initializer=_init_executor_process
+        )
+
+
+async def on_cleanup(app):
+    await app["session"].close()
+    app["executor"].shutdown()
+
+
+def make_app():
+    """Create the application."""
+    app = web.Application(middlewares=[not_found])
+    app.router.add_get("/", index, name="index")
+    app.router.add_get("/page", wiki, name="wiki")
+    app.router.add_post("/api/score", api_score, name="api_score")
+    app.router.add_get("/cache", cache_stats, name="cache_stats")
+    app.router.add_get("/metrics", metrics_text, name="metrics_text")
+    app.router.add_get("/about", about, name="about")
+    app.router.add_static("/static", STATIC_DIR, name="static")
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = make_app()
+
+
+if __name__ == "__main__":
+    web.run_app(app, port=8000)
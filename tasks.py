@@ -19,11 +19,39 @@ def setup(c):
     c.run("conda env create --force -f environment.yml")
 
 @task
-def run_app(c, workers=4, port=8000):
-    """Run the web application for production"""
+def run_app(c, workers=4, port=8000, preload=False):
+    """Run the web application for production
+
+    With ``--preload`` the model is loaded once in the master process and
+    shared by the workers.
+    """
     pwd = os.getcwd()
     # c.run(f"docker run -v {pwd}:/home/jovyan/work -p 0.0.0.0:{port}:{port} wikidit gunicorn -w {workers} app")
-    c.run(f"gunicorn -p 0.0.0.0:{port} -w {workers} app:app")
+    if preload:
+        c.run(
+            f"gunicorn --preload -b 0.0.0.0:{port} -w {workers} app:app",
+            env={"WIKIDIT_PRELOAD": "1"},
+        )
+    else:
+        c.run(f"gunicorn -b 0.0.0.0:{port} -w {workers} app:app")
+
+@task
+def run_service(c, socket="/tmp/wikidit.sock", workers=None):
+    """Run the featurization and scoring service shared by the app workers
+
+    Start the app with ``WIKIDIT_SERVICE`` set to ``socket`` to use it.
+    """
+    jobs = f" -j {workers}" if workers else ""
+    c.run(f"python -m wikidit.scripts.featurize_service {socket}{jobs}")
+
+@task
+def run_async_app(c, workers=1, port=8000):
+    """Run the asynchronous web application for production"""
+    c.run(
+        f"gunicorn -b 0.0.0.0:{port} -w {workers} "
+        "--worker-class aiohttp.GunicornWebWorker app_async:app"
+    )
+
 
 @task
 def dev_app(c):
@@ -0,0 +1,91 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class StubAPI:
+    """A stub of the MediaWiki API which returns canned responses.
+
+    Each request is answered with the next of ``responses``, and its
+    parameters are appended to ``requests``. ``host`` is the host to create
+    a session with.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.responses = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def respond(self, params):
+        with self.lock:
+            self.requests.append(params)
+            if not self.responses:
+                return {"error": {"code": "stub", "info": "No canned response"}}
+            return self.responses.pop(0)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = urllib.parse.urlparse(self.path).query
+        params = dict(urllib.parse.parse_qsl(query, keep_blank_values=True))
+        body = json.dumps(self.server.stub.respond(params)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mw_api():
+    """A :class:`StubAPI` served on a local port."""
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.stub = StubAPI(f"http://127.0.0.1:{server.server_address[1]}")
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server.stub
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def quality_model():
+    """A small quality model with the pipeline of the trained model."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    from wikidit.models import RevisionPreprocessor
+    from wikidit.ordinal import SequentialClassifier
+    from wikidit.preprocessing import WP10_LABELS
+
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(
+        rng.poisson(5, size=(300, len(RevisionPreprocessor.INPUT_COLS))),
+        columns=RevisionPreprocessor.INPUT_COLS,
+    )
+    X["words"] = rng.poisson(500, size=len(X)) + 1
+    noise = rng.normal(size=len(X))
+    y = np.digitize(X["ref"] + X["words"] / 100 + noise, [7, 8, 9, 10, 11])
+    assert len(np.unique(y)) == len(WP10_LABELS)
+    return make_pipeline(
+        RevisionPreprocessor(),
+        StandardScaler(),
+        SequentialClassifier(LogisticRegression()),
+    ).fit(X, y)
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+app = pytest.importorskip("app")
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [None, {}, {"titles": "Banana"}, {"titles": [1]}, {"titles": ["A|B"]}],
+)
+def test_api_score_bad_request(client, body):
+    response = client.post("/api/score", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_api_score_too_many_titles(client, monkeypatch):
+    monkeypatch.setattr(app, "MAX_TITLES", 2)
+    response = client.post("/api/score", json={"titles": ["A", "B", "C"]})
+    assert response.status_code == 400
+    assert "At most 2" in response.get_json()["error"]
+
+
+def test_predict_revision_busy(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def predict_content(content, approximate=False):
+        calls.append(approximate)
+        if not approximate:
+            release.wait(5)
+        return {"approximate": approximate}
+
+    monkeypatch.setattr(app, "predict_content", predict_content)
+    monkeypatch.setattr(app, "FEATURIZE_TIMEOUT", 0.01)
+    monkeypatch.setattr(app, "FEATURIZE_WORKERS", 1)
+    monkeypatch.setattr(app, "_executor", None)
+    monkeypatch.setattr(app.CACHE, "get", lambda revid: None)
+    monkeypatch.setattr(app.CACHE, "set", lambda revid, result: None)
+    try:
+        page = {"revid": 1, "content": "Text"}
+        assert app.predict_revision(page) == {"approximate": True}
+        # The only thread is busy, so nothing more is submitted to it
+        assert app.predict_revision(page) == {"approximate": True}
+        assert sorted(calls) == [False, True, True]
+    finally:
+        release.set()
+        app._executor.shutdown()
+
+
+def test_predict_revision_timings_from_executor(monkeypatch):
+    def predict_content(content, approximate=False):
+        with app.metrics.timer("featurize"):
+            pass
+        return {"approximate": approximate}
+
+    monkeypatch.setattr(app, "predict_content", predict_content)
+    monkeypatch.setattr(app, "FEATURIZE_TIMEOUT", 5)
+    monkeypatch.setattr(app, "_executor", None)
+    monkeypatch.setattr(app.CACHE, "get", lambda revid: None)
+    monkeypatch.setattr(app.CACHE, "set", lambda revid, result: None)
+    monkeypatch.setattr(app.metrics, "ENABLED", True)
+    try:
+        app.metrics.start_request()
+        app.predict_revision({"revid": 1, "content": "Text"})
+        assert "featurize" in app.metrics.end_request()
+    finally:
+        app._executor.shutdown()
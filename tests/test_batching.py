@@ -0,0 +1,85 @@
+import multiprocessing
+import threading
+
+import numpy as np
+import pytest
+
+from wikidit.batching import MicroBatcher
+
+
+def call_concurrently(batcher, inputs):
+    """Call ``batcher`` with each of ``inputs`` in its own thread."""
+    results = [None] * len(inputs)
+    barrier = threading.Barrier(len(inputs))
+
+    def call(i):
+        barrier.wait()
+        try:
+            results[i] = batcher(inputs[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_callers_get_their_rows():
+    batches = []
+
+    def func(rows):
+        batches.append(len(rows))
+        return rows * 2
+
+    inputs = [np.full((n, 3), i, dtype=np.float32) for i, n in enumerate([1, 4, 2, 3])]
+    # The batch is only processed once it has the rows of every caller
+    batcher = MicroBatcher(func, max_wait=10, max_rows=10)
+    results = call_concurrently(batcher, inputs)
+    assert batches == [10]
+    for x, result in zip(inputs, results):
+        np.testing.assert_array_equal(result, x * 2)
+
+
+def test_errors_reach_every_caller():
+    def func(rows):
+        raise ValueError("Bad rows")
+
+    batcher = MicroBatcher(func, max_wait=10, max_rows=3)
+    results = call_concurrently(batcher, [np.zeros((1, 2))] * 3)
+    assert all(isinstance(x, ValueError) for x in results)
+    # The batcher still processes later calls
+    batcher.func = lambda rows: rows + 1
+    batcher.max_wait = 0
+    np.testing.assert_array_equal(batcher(np.zeros((1, 2))), np.ones((1, 2)))
+
+
+def _call_in_child(batcher, conn):
+    conn.send(batcher(np.ones((2, 2))))
+    conn.close()
+
+
+def test_restarts_after_fork():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork is not available")
+    batcher = MicroBatcher(lambda rows: rows * 3, max_wait=0)
+    np.testing.assert_array_equal(batcher(np.ones((1, 2))), np.full((1, 2), 3))
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe()
+    process = context.Process(target=_call_in_child, args=(batcher, child))
+    process.start()
+    assert parent.poll(10)
+    np.testing.assert_array_equal(parent.recv(), np.full((2, 2), 3))
+    process.join(10)
+    assert process.exitcode == 0
+
+
+def test_bad_rows_reach_every_caller():
+    batcher = MicroBatcher(lambda rows: rows[:1], max_wait=10, max_rows=2)
+    # Rows which cannot be concatenated, and output with too few rows
+    results = call_concurrently(batcher, [np.zeros((1, 2)), np.zeros((1, 3))])
+    assert all(isinstance(x, ValueError) for x in results)
+    results = call_concurrently(batcher, [np.zeros((1, 2))] * 2)
+    assert all(isinstance(x, ValueError) for x in results)
@@ -0,0 +1,31 @@
+import time
+
+from wikidit.cache import SQLiteRevisionCache
+
+
+def test_sqlite_lru(tmp_path):
+    cache = SQLiteRevisionCache(str(tmp_path / "cache.db"), maxsize=2, touch_interval=0)
+    cache.set(1, "a")
+    time.sleep(0.01)
+    cache.set(2, "b")
+    time.sleep(0.01)
+    assert cache.get(1) == "a"
+    time.sleep(0.01)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+
+
+def test_sqlite_touch_interval(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteRevisionCache(path, maxsize=2, touch_interval=3600)
+    cache.set(1, "a")
+    accessed = cache._connect().execute("SELECT accessed FROM cache").fetchone()[0]
+    assert cache.get(1) == "a"
+    # Recently used entries are not updated on a hit
+    assert (
+        cache._connect().execute("SELECT accessed FROM cache").fetchone()[0]
+        == accessed
+    )
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,84 @@
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wikidit.compiled import CompiledModel, check_model, export_model
+from wikidit.models import RevisionPreprocessor
+from wikidit.ordinal import SequentialClassifier
+
+
+class LinearBooster:
+    """A stub of an XGBoost booster of a binary classifier."""
+
+    def __init__(self, coef):
+        self.coef = np.asarray(coef, dtype=np.float32)
+
+    def inplace_predict(self, X, iteration_range=(0, 0)):
+        return 1 / (1 + np.exp(-X @ self.coef))
+
+
+def test_predict_proba_selects_columns():
+    manifest = {
+        "sequential": False,
+        "classes": [0, 1],
+        "preprocess": False,
+        "columns": ["a", "b"],
+        "stages": [{"file": "stage-0.json", "iteration_range": [0, 0]}],
+    }
+    model = CompiledModel([LinearBooster([1.0, -2.0])], manifest)
+    X = np.array([[1.0, 0.5], [0.0, 2.0]])
+    expected = model.predict_proba(X)
+    reordered = pd.DataFrame({"b": X[:, 1], "a": X[:, 0]})
+    np.testing.assert_allclose(model.predict_proba(reordered), expected)
+    records = reordered.to_dict("records")
+    np.testing.assert_allclose(model.predict_proba(records), expected)
+
+
+def test_check_model_differs():
+    class Model:
+        def predict_proba(self, X):
+            return np.full((len(X), 2), 0.5)
+
+    class Compiled:
+        def predict_proba(self, X):
+            return np.tile([0.4, 0.6], (len(X), 1))
+
+    check_model(Model(), Model(), np.zeros((3, 1)))
+    with pytest.raises(ValueError):
+        check_model(Model(), Compiled(), np.zeros((3, 1)))
+
+
+@pytest.mark.parametrize("format", ["json", "ubj"])
+def test_export_pipeline(tmp_path, format):
+    xgboost = pytest.importorskip("xgboost", minversion="1.6")
+    from sklearn.pipeline import make_pipeline
+
+    rng = np.random.RandomState(0)
+    rows = [
+        {
+            **{col: int(rng.poisson(5)) for col in RevisionPreprocessor.INPUT_COLS},
+            "words": int(rng.poisson(500)) + 1,
+        }
+        for _ in range(200)
+    ]
+    X = pd.DataFrame.from_records(rows)
+    y = np.digitize(X["ref"] + X["words"] / 100, [7, 10, 13])
+    model = make_pipeline(
+        RevisionPreprocessor(),
+        SequentialClassifier(xgboost.XGBClassifier(n_estimators=10, max_depth=2)),
+    ).fit(X, y)
+    export_model(model, str(tmp_path), format=format)
+    compiled = CompiledModel.load(str(tmp_path))
+    check_model(model, compiled, X)
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+
+
+def test_export_requires_new_xgboost(monkeypatch, tmp_path):
+    old_xgboost = types.SimpleNamespace(__version__="0.80")
+    monkeypatch.setitem(sys.modules, "xgboost", old_xgboost)
+    with pytest.raises(RuntimeError, match="XGBoost >= 1.4"):
+        export_model(object(), str(tmp_path))
+    assert not any(tmp_path.iterdir())
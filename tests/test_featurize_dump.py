@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq  # noqa: E402
+
+from wikidit.scripts.featurize_dump import featurize_shard, parquet_schema  # noqa: E402
+
+DUMP = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <dbname>enwiki</dbname>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+    </namespaces>
+  </siteinfo>
+{pages}
+</mediawiki>
+"""
+
+PAGE = """  <page>
+    <title>{title}</title>
+    <ns>{ns}</ns>
+    <id>{id}</id>
+    <revision>
+      <id>{id}0</id>
+      <timestamp>2019-03-04T00:00:00Z</timestamp>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve">{text}</text>
+    </revision>
+  </page>"""
+
+
+def write_dump(path, *pages):
+    path.write_text(DUMP.format(pages="\n".join(PAGE.format(**x) for x in pages)))
+    return ("file", str(path))
+
+
+def test_featurize_shard(tmp_path):
+    shard = write_dump(
+        tmp_path / "dump.xml",
+        {"title": "Banana", "ns": 0, "id": 1, "text": "A '''banana''' is a fruit."},
+        {"title": "Talk:Banana", "ns": 1, "id": 2, "text": "Yellow?"},
+    )
+    filename = str(tmp_path / "part-00000.parquet")
+    assert featurize_shard(shard, filename, word_counter="regex") == 1
+    table = pq.read_table(filename)
+    assert table.schema.equals(parquet_schema())
+    (row,) = table.to_pylist()
+    assert row["rev_id"] == 10
+    assert row["page_title"] == "Banana"
+    assert row["words"] == 6
+    assert row["backlog_style_templates"] is None
+
+
+def test_featurize_empty_shard(tmp_path):
+    shard = write_dump(
+        tmp_path / "dump.xml", {"title": "Talk:Banana", "ns": 1, "id": 2, "text": "?"}
+    )
+    filename = str(tmp_path / "part-00000.parquet")
+    assert featurize_shard(shard, filename, word_counter="regex") == 0
+    table = pq.read_table(filename)
+    assert table.num_rows == 0
+    assert table.schema.equals(parquet_schema())
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from test_mw import page, query
+from wikidit.models import (
+    EDITS,
+    RevisionPreprocessor,
+    _apply_edits,
+    _revision_vector,
+    edit_grid,
+    make_edits,
+    page_edit_results,
+    page_edit_rows,
+    predict_page_edits,
+    predict_page_edits_api,
+    score_revisions,
+)
+from wikidit.mw import Session
+from wikidit.preprocessing import Featurizer, WP10_LABELS
+
+
+def revision(**counts):
+    out = {col: 0 for col in RevisionPreprocessor.INPUT_COLS}
+    out["words"] = 100
+    out["backlog_style"] = 1
+    out["coordinates"] = False
+    out.update(counts)
+    return out
+
+
+def test_make_edits_matches_grid():
+    page = revision()
+    deltas, grid = edit_grid(EDITS)
+    rows = _apply_edits(_revision_vector(page), deltas)[1:]
+    edited = make_edits(page)
+    assert [name for name, _, _ in edited] == [edit.name for edit, _ in grid]
+    for (_, x, _), row in zip(edited, rows):
+        np.testing.assert_array_equal(_revision_vector(x), row)
+    assert page == revision()
+
+
+class Model:
+    """Predicts the median class of probabilities, like the trained model."""
+
+    def predict_from_proba(self, prob):
+        return np.argmax(np.cumsum(prob, axis=1) >= 0.5, axis=1)
+
+
+def test_top_edits_ranked_by_gain():
+    deltas, grid = edit_grid(EDITS)
+    rows = _apply_edits(_revision_vector(revision()), deltas)
+    rng = np.random.RandomState(0)
+    probs = rng.dirichlet(np.ones(len(WP10_LABELS)), size=len(rows))
+    result = page_edit_results(rows, probs, Model())
+    gains = [change for _, _, change in result["top_edits"]]
+    assert gains == sorted(gains, reverse=True)
+    assert all(gain > 0 for gain in gains)
+
+
+def test_edits_have_revision_features(quality_model):
+    content = "A '''banana''' is a fruit.{{cn}}\n[[Category:Fruit]]"
+    featurizer = Featurizer(word_counter="regex")
+    result = predict_page_edits(content, featurizer, quality_model)
+    rows, _ = page_edit_rows(content, featurizer)
+    columns = set(featurizer.parse_content(content)) - {"text"}
+    assert len(result["edits"]) == len(rows) - 1
+    for (_, _, frame), row in zip(result["edits"], rows[1:]):
+        assert set(frame.columns) == columns
+        np.testing.assert_array_equal(
+            frame[RevisionPreprocessor.INPUT_COLS].to_numpy(np.float32)[0], row
+        )
+
+
+def test_score_revisions_all_cpus(quality_model):
+    contents = ["A '''banana''' is a fruit.", "[[Apple]]s are fruit too.{{cn}}"]
+    expected = score_revisions(contents, quality_model, word_counter="regex")
+    actual = score_revisions(contents, quality_model, n_jobs=-1, word_counter="regex")
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_predict_page_edits_api(mw_api, quality_model):
+    mw_api.responses.append(query(page(1, "Banana", "A '''banana''' is a fruit.")))
+    mw_api.responses.append(query({"ns": 0, "title": "Nope", "missing": ""}))
+    session = Session(mw_api.host)
+    featurizer = Featurizer(word_counter="regex")
+    best = predict_page_edits_api(
+        "Banana", quality_model, lambda x: x["best"], featurizer, session
+    )
+    assert best in WP10_LABELS
+    missing = predict_page_edits_api("Nope", quality_model, None, featurizer, session)
+    assert missing is None
@@ -0,0 +1,205 @@
+import asyncio
+
+import mwapi
+import pytest
+
+from wikidit.mw import (
+    AsyncSession,
+    Session,
+    get_page,
+    get_page_async,
+    get_pages,
+    get_pages_async,
+    parse_assessments,
+    query_pages_async,
+)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def page(pageid, title, content=None, assessments=None):
+    """A page of a query response."""
+    out = {"pageid": pageid, "ns": 0, "title": title}
+    if content is not None:
+        out["revisions"] = [
+            {
+                "revid": pageid * 10,
+                "parentid": pageid * 10 - 1,
+                "timestamp": "2019-03-04T00:00:00Z",
+                "slots": {"main": {"contentmodel": "wikitext", "*": content}},
+            }
+        ]
+    if assessments is not None:
+        out["pageassessments"] = {
+            project: {"class": klass, "importance": ""}
+            for project, klass in assessments.items()
+        }
+    return out
+
+
+def query(*pages, **other):
+    """A query response. Missing and invalid pages have negative keys."""
+    keys = (str(x.get("pageid", -i)) for i, x in enumerate(pages, 1))
+    return {
+        "batchcomplete": "",
+        "query": {"pages": dict(zip(keys, pages)), **other},
+    }
+
+
+def test_get_page(mw_api):
+    mw_api.responses.append(
+        query(
+            page(736, "Albert Einstein", "Text", {"Physics": "GA", "Biography": "B"})
+        )
+    )
+    rev = get_page("Albert Einstein", Session(mw_api.host))
+    assert rev["title"] == "Albert Einstein"
+    assert rev["content"] == "Text"
+    assert rev["revid"] == 7360
+    assert rev["quality"] == "GA"
+    # One request, for the article only
+    (params,) = mw_api.requests
+    assert params["titles"] == "Albert Einstein"
+    assert params["prop"] == "revisions|pageassessments"
+
+
+def test_get_page_normalized_redirect(mw_api):
+    mw_api.responses.append(
+        query(
+            page(736, "Albert Einstein", "Text", {"Physics": "FA"}),
+            normalized=[{"from": "einstein", "to": "Einstein"}],
+            redirects=[{"from": "Einstein", "to": "Albert Einstein"}],
+        )
+    )
+    rev = get_page("einstein", Session(mw_api.host))
+    assert rev["title"] == "Albert Einstein"
+    assert rev["quality"] == "FA"
+
+
+def test_get_page_missing(mw_api):
+    mw_api.responses.append(query({"ns": 0, "title": "No such page", "missing": ""}))
+    assert get_page("No such page", Session(mw_api.host)) is None
+
+
+def test_get_page_without_talk_page(mw_api):
+    # Pages without a talk page have no assessments
+    mw_api.responses.append(query(page(5, "Unassessed", "Text")))
+    rev = get_page("Unassessed", Session(mw_api.host))
+    assert rev["content"] == "Text"
+    assert rev["quality"] is None
+    assert len(mw_api.requests) == 1
+
+
+def test_get_page_continuation(mw_api):
+    first = query(page(736, "Albert Einstein", "Text", {"Physics": "B"}))
+    first["continue"] = {"pacontinue": "736|Physics", "continue": "||revisions"}
+    mw_api.responses.append(first)
+    mw_api.responses.append(
+        query(page(736, "Albert Einstein", assessments={"Biography": "GA"}))
+    )
+    rev = get_page("Albert Einstein", Session(mw_api.host))
+    assert rev["content"] == "Text"
+    assert rev["quality"] == "GA"
+    assert mw_api.requests[1]["pacontinue"] == "736|Physics"
+
+
+def test_get_page_invalid_title(mw_api):
+    assert get_page("A|B", Session(mw_api.host)) is None
+    assert get_page("", Session(mw_api.host)) is None
+    assert mw_api.requests == []
+
+
+def test_get_pages(mw_api):
+    mw_api.responses.append(
+        query(
+            page(1, "Banana", "Yellow", {"Plants": "C"}),
+            {"ns": 0, "title": "Nope", "missing": ""},
+            {"title": "A<b", "invalidreason": "Invalid characters", "invalid": ""},
+        )
+    )
+    titles = ["Banana", "Nope", "A<b", "A|B"]
+    pages = get_pages(titles, Session(mw_api.host))
+    assert list(pages) == titles
+    assert pages["Banana"]["quality"] == "C"
+    assert pages["Nope"] is None
+    assert pages["A<b"] is None
+    assert pages["A|B"] is None
+    (params,) = mw_api.requests
+    assert params["titles"] == "Banana|Nope|A<b"
+
+
+def test_parse_assessments():
+    assert parse_assessments({}) is None
+    assert parse_assessments({"A": {"class": "Start"}, "B": {"class": "A"}}) == "GA"
+    assert parse_assessments({"A": {"class": "List"}, "B": {"class": ""}}) is None
+
+
+async def _get_page_async(host, title):
+    async with AsyncSession(host) as session:
+        return await get_page_async(title, session)
+
+
+def test_get_page_async(mw_api):
+    pytest.importorskip("aiohttp")
+    first = query(
+        page(736, "Albert Einstein", "Text", {"Physics": "B"}),
+        normalized=[{"from": "albert einstein", "to": "Albert einstein"}],
+        redirects=[{"from": "Albert einstein", "to": "Albert Einstein"}],
+    )
+    first["continue"] = {"pacontinue": "736|Physics", "continue": "||revisions"}
+    mw_api.responses.append(first)
+    mw_api.responses.append(
+        query(page(736, "Albert Einstein", assessments={"Biography": "GA"}))
+    )
+    rev = run(_get_page_async(mw_api.host, "albert einstein"))
+    assert rev["title"] == "Albert Einstein"
+    assert rev["content"] == "Text"
+    assert rev["quality"] == "GA"
+    first_params, second_params = mw_api.requests
+    assert first_params["titles"] == "albert einstein"
+    assert first_params["redirects"] == ""
+    assert first_params["format"] == "json"
+    assert second_params["pacontinue"] == "736|Physics"
+
+
+def test_get_page_async_missing(mw_api):
+    pytest.importorskip("aiohttp")
+    mw_api.responses.append(query({"ns": 0, "title": "Nope", "missing": ""}))
+    assert run(_get_page_async(mw_api.host, "Nope")) is None
+    assert run(_get_page_async(mw_api.host, "A|B")) is None
+    assert len(mw_api.requests) == 1
+
+
+def test_query_pages_async_error(mw_api):
+    pytest.importorskip("aiohttp")
+    mw_api.responses.append({"error": {"code": "maxlag", "info": "Waiting"}})
+
+    async def query_error():
+        async with AsyncSession(mw_api.host) as session:
+            await query_pages_async(session, titles="A", prop="revisions")
+
+    with pytest.raises(mwapi.errors.APIError):
+        run(query_error())
+
+
+def test_get_pages_async(mw_api):
+    pytest.importorskip("aiohttp")
+    mw_api.responses.append(query(page(1, "Banana", "Yellow", {"Plants": "C"})))
+    mw_api.responses.append(query({"ns": 0, "title": "Nope", "missing": ""}))
+
+    async def get():
+        async with AsyncSession(mw_api.host) as session:
+            return await get_pages_async(["Banana", "A|B", "Nope"], session, 2)
+
+    pages = run(get())
+    assert list(pages) == ["Banana", "A|B", "Nope"]
+    assert pages["Banana"]["quality"] == "C"
+    assert pages["A|B"] is None
+    assert pages["Nope"] is None
+    assert sorted(params["titles"] for params in mw_api.requests) == ["Banana", "Nope"]
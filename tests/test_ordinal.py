@@ -0,0 +1,74 @@
+import pickle
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from wikidit.ordinal import SequentialClassifier
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(300, 4))
+    y = np.digitize(X @ [1.0, 0.5, -0.5, 0.2] + rng.normal(size=300), [-1, 0, 1])
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def model(data):
+    return SequentialClassifier(LogisticRegression()).fit(*data)
+
+
+def test_predict_proba(model, data):
+    X, _ = data
+    prob = model.predict_proba(X)
+    assert prob.shape == (len(X), 4)
+    np.testing.assert_allclose(prob.sum(axis=1), 1)
+    # Class k stops at stage k after passing the earlier stages
+    stages = [clf.predict_proba(X) for clf in model.estimators_]
+    passed = np.ones(len(X))
+    for k, stage in enumerate(stages):
+        np.testing.assert_allclose(prob[:, k], passed * stage[:, 0])
+        passed *= stage[:, 1]
+    np.testing.assert_allclose(prob[:, -1], passed)
+
+
+def test_predict_n_jobs(model, data):
+    X, _ = data
+    threaded = SequentialClassifier(LogisticRegression(), predict_n_jobs=2)
+    threaded.estimators_ = model.estimators_
+    threaded.n_classes_ = model.n_classes_
+    np.testing.assert_array_equal(threaded.predict_proba(X), model.predict_proba(X))
+
+
+def test_predict_early_exit(model, data):
+    X, _ = data
+    np.testing.assert_array_equal(model.predict(X, early_exit=True), model.predict(X))
+
+
+def test_unpickle_without_new_params(model, data):
+    X, _ = data
+    old = pickle.loads(pickle.dumps(model))
+    del old.__dict__["predict_n_jobs"]
+    del old.__dict__["estimator_n_jobs"]
+    old = pickle.loads(pickle.dumps(old))
+    assert old.predict_n_jobs is None
+    np.testing.assert_array_equal(old.predict_proba(X), model.predict_proba(X))
+
+
+def test_feature_names(data):
+    X, y = data
+    df = pd.DataFrame(X, columns=list("abcd"))
+    model = SequentialClassifier(LogisticRegression()).fit(df, y)
+    assert list(model.feature_names_in_) == list("abcd")
+    expected = SequentialClassifier(LogisticRegression()).fit(X, y).predict_proba(X)
+    with warnings.catch_warnings():
+        # The stages were fit on arrays, so they warn if given feature names
+        warnings.simplefilter("error")
+        np.testing.assert_allclose(model.predict_proba(df[list("dcba")]), expected)
+        np.testing.assert_array_equal(
+            model.predict(df, early_exit=True), model.predict(X)
+        )
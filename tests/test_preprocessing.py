@@ -0,0 +1,38 @@
+import os.path
+
+import mwparserfromhell as mwparser
+import pytest
+
+from wikidit.preprocessing import Featurizer, count_words_regex
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture(scope="module")
+def sample_text():
+    with open(os.path.join(DATA_DIR, "sample.wikitext"), "r") as f:
+        return mwparser.parse(f.read()).strip_code()
+
+
+def test_count_words_regex_contractions():
+    pytest.importorskip("spacy")
+    text = "John's dog doesn't bark; it's the students' cat. O'Brien can't, I'm"
+    assert count_words_regex(text) == Featurizer().count_words(text)
+
+
+def test_count_words_regex_tolerance(sample_text):
+    pytest.importorskip("spacy")
+    expected = Featurizer(word_counter="spacy").count_words(sample_text)
+    actual = Featurizer(word_counter="regex").count_words(sample_text)
+    assert abs(actual - expected) <= 0.01 * expected
+
+
+def test_approximate_flag():
+    with open(os.path.join(DATA_DIR, "sample.wikitext"), "r") as f:
+        content = f.read()
+    exact = Featurizer(word_counter="regex").parse_content(content)
+    approximate = Featurizer(word_counter="regex", max_bytes=0).parse_content(content)
+    # Only approximate features are flagged, so exact ones keep their schema
+    assert "approximate" not in exact
+    assert approximate.pop("approximate") is True
+    assert approximate.keys() == exact.keys()
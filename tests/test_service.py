@@ -0,0 +1,87 @@
+import os
+import socket
+import stat
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from wikidit.models import predict_page_edits, score_revisions
+from wikidit.preprocessing import Featurizer
+from wikidit.service import RESULT_KEYS, FeaturizeService, ServiceClient
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture(scope="module")
+def contents():
+    with open(os.path.join(DATA_DIR, "sample.wikitext"), "r") as f:
+        sample = f.read()
+    return [sample, "A '''banana''' is a fruit.{{cn}}", sample[:2000]]
+
+
+@pytest.fixture
+def service(quality_model, tmp_path):
+    address = str(tmp_path / "wikidit.sock")
+    service = FeaturizeService(
+        address, n_workers=1, model=quality_model, word_counter="regex"
+    )
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    client = ServiceClient(address)
+    for _ in range(500):
+        if os.path.exists(address):
+            break
+        thread.join(0.01)
+    yield client
+    service.shutdown()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_predict(service, quality_model, contents):
+    featurizer = Featurizer(word_counter="regex")
+    for content in contents:
+        expected = predict_page_edits(content, featurizer, quality_model)
+        actual = service.predict(content)
+        assert actual.keys() == set(RESULT_KEYS)
+        assert actual["best"] == expected["best"]
+        assert actual["approximate"] is False
+        np.testing.assert_allclose(actual["score"], expected["score"], rtol=1e-6)
+        assert [x[:2] for x in actual["top_edits"]] == [
+            x[:2] for x in expected["top_edits"]
+        ]
+
+
+def test_score_revisions(service, quality_model, contents):
+    expected = score_revisions(contents, quality_model, word_counter="regex")
+    actual = service.score_revisions(contents)
+    pd.testing.assert_frame_equal(
+        actual[expected.columns], expected, check_exact=False, rtol=1e-6
+    )
+
+
+def test_socket_permissions(service, tmp_path):
+    mode = os.stat(tmp_path / "wikidit.sock").st_mode
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) & 0o077 == 0
+
+
+def test_replaces_only_sockets(quality_model, tmp_path):
+    path = tmp_path / "wikidit.sock"
+    path.write_text("data")
+    with pytest.raises(FileExistsError):
+        FeaturizeService(str(path), n_workers=1, model=quality_model).serve_forever()
+    assert path.read_text() == "data"
+    path.unlink()
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(str(path))
+    service = FeaturizeService(str(path), n_workers=1, model=quality_model)
+    service._remove_socket()
+    assert not path.exists()
+
+
+def test_version(service):
+    version = service.version()
+    assert version.startswith("custom-")
+    assert version.endswith(Featurizer(word_counter="regex").version)
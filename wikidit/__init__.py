@@ -1 +1,13 @@
-from . import preprocessing, mw, models, io, scripts
+"""Predict the quality of Wikipedia articles and suggest edits to improve them.
+
+Submodules are imported on first use so that importing the package is cheap.
+"""
+import importlib
+
+__all__ = ["preprocessing", "mw", "models", "compiled", "io", "scripts"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,152 @@
+"""Coalesce concurrent model calls into batches.
+
+Each page is scored with one model call on the rows of its edits, which is
+small enough that the fixed cost of a call, e.g. the input checks of
+scikit-learn and the setup of XGBoost, dominates. :class:`MicroBatcher`
+collects the rows of concurrent calls for a few milliseconds, or until there
+are enough rows, scores them with one call, and returns each caller its
+rows. :class:`BatchedModel` wraps a model so that its ``predict_proba`` is
+batched, and can be used wherever the model is.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .models import RevisionPreprocessor, _predict_rows, predict_from_proba
+
+
+class MicroBatcher:
+    """Batch concurrent calls of a function of arrays of rows.
+
+    ``func`` takes an array of rows and returns an array with a row for
+    each, e.g. the class probabilities. Calls block until their rows have
+    been processed. The rows are processed by a background thread, started
+    on first use in each process.
+
+    Parameters
+    -----------
+    func:
+        Function called with the concatenated rows of a batch.
+    max_wait:
+        Seconds to wait for more rows after the first row of a batch.
+    max_rows:
+        Number of rows after which a batch is processed without waiting.
+        A single call with more rows is processed as a batch by itself.
+
+    """
+
+    def __init__(
+        self,
+        func: Callable[[np.ndarray], np.ndarray],
+        max_wait: float = 0.002,
+        max_rows: int = 1024,
+    ) -> None:
+        self.func = func
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self) -> None:
+        # Threads do not survive forking, e.g. of preloaded gunicorn workers
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                thread = threading.Thread(
+                    target=self._run, args=(self._queue,), daemon=True
+                )
+                thread.start()
+                self._pid = os.getpid()
+
+    def _collect(self, requests: "queue.Queue") -> list:
+        batch = [requests.get()]
+        n_rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_rows:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch
+
+    def _run(self, requests: "queue.Queue") -> None:
+        while True:
+            batch = self._collect(requests)
+            # Any error is passed to the callers, since the thread must keep
+            # running for them to get their results.
+            try:
+                rows = np.concatenate([rows for rows, _ in batch])
+                metrics.increment("wikidit_batches_total")
+                metrics.increment("wikidit_batched_rows_total", len(rows))
+                out = self.func(rows)
+                splits = np.cumsum([len(rows) for rows, _ in batch])[:-1]
+                results = np.split(out, splits)
+                if len(out) != len(rows):
+                    raise ValueError(f"Got {len(out)} outputs for {len(rows)} rows")
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), x in zip(batch, results):
+                future.set_result(x)
+
+    def __call__(self, rows: np.ndarray) -> np.ndarray:
+        """Process ``rows`` in the next batch and return their output."""
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((rows, future))
+        return future.result()
+
+
+class BatchedModel:
+    """A quality model whose ``predict_proba`` calls are batched.
+
+    Parameters
+    -----------
+    model:
+        The quality prediction model.
+    max_wait, max_rows:
+        See :class:`MicroBatcher`.
+
+    """
+
+    def __init__(self, model, max_wait: float = 0.002, max_rows: int = 1024) -> None:
+        self.model = model
+        self.batcher = MicroBatcher(
+            lambda rows: _predict_rows(rows, model),
+            max_wait=max_wait,
+            max_rows=max_rows,
+        )
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Predict class probabilities of revisions.
+
+        ``X`` is a data frame with the columns in
+        :attr:`RevisionPreprocessor.INPUT_COLS`, or an array of them.
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[RevisionPreprocessor.INPUT_COLS]
+        return self.batcher(np.asarray(X, dtype=np.float32))
+
+    def predict_from_proba(self, prob: np.ndarray) -> np.ndarray:
+        """Predict classes from probabilities computed by this model."""
+        return predict_from_proba(self.model, prob)
+
+    def predict(self, X) -> np.ndarray:
+        """Predict classes."""
+        return self.predict_from_proba(self.predict_proba(X))
+
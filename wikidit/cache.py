@@ -0,0 +1,212 @@
+"""Caches for featurized revisions and predictions.
+
+Entries are keyed by revision id or by the hash of the revision content.
+Since the content of a revision never changes, a cached entry only becomes
+stale when the page is edited, and then the page has a new revision id.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class RevisionCache:
+    """A bounded, in-memory LRU cache with an optional time-to-live.
+
+    Parameters
+    -----------
+    maxsize:
+        Maximum number of entries. The least recently used entries are
+        removed when the cache is full. If ``None``, the cache is unbounded.
+    ttl:
+        Number of seconds after which an entry expires. If ``None``, entries
+        never expire.
+
+    """
+
+    def __init__(
+        self, maxsize: Optional[int] = 1024, ttl: Optional[float] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for ``key`` or ``None`` if it is not cached."""
+        with self._lock:
+            try:
+                created, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if self._expired(created):
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Add ``value`` to the cache."""
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[Hashable, Any]]) -> None:
+        """Add many ``(key, value)`` pairs to the cache."""
+        now = time.time()
+        with self._lock:
+            for key, value in items:
+                self._data[key] = (now, value)
+                self._data.move_to_end(key)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        """Return the number of entries, hits, and misses."""
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SQLiteRevisionCache(RevisionCache):
+    """A bounded, approximately LRU cache stored in a SQLite database.
+
+    All processes which use the same ``path``, e.g. the workers of a
+    gunicorn server, share the same entries. Values are pickled. The hit and
+    miss counts are for this process only.
+
+    So that most reads do not write to the database, the time an entry was
+    last used is only updated when it is older than ``touch_interval``
+    seconds. Entries used within that interval of each other can be evicted
+    in any order.
+
+    Parameters
+    -----------
+    path:
+        Path of the SQLite database. It is created if it does not exist.
+    maxsize:
+        Maximum number of entries. If ``None``, the cache is unbounded and
+        reads do not need to record when entries were last used.
+    ttl:
+        Number of seconds after which an entry expires. If ``None``, entries
+        never expire.
+    touch_interval:
+        Minimum number of seconds between updates of the time an entry was
+        last used.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        maxsize: Optional[int] = 1024,
+        ttl: Optional[float] = None,
+        touch_interval: float = 60,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        self.touch_interval = touch_interval
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache "
+                    "(key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections cannot be shared with forked processes, so open a new
+        # one in each process.
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for ``key`` or ``None`` if it is not cached."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created, accessed FROM cache WHERE key = ?",
+                (str(key),),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created, accessed = row
+            if self._expired(created):
+                conn.execute("DELETE FROM cache WHERE key = ?", (str(key),))
+                self.misses += 1
+                return None
+            if self.maxsize is not None and now - accessed >= self.touch_interval:
+                conn.execute(
+                    "UPDATE cache SET accessed = ? WHERE key = ?", (now, str(key))
+                )
+            self.hits += 1
+        return pickle.loads(value)
+
+    def set_many(self, items: Iterable[Tuple[Hashable, Any]]) -> None:
+        """Add many ``(key, value)`` pairs to the cache in one transaction."""
+        now = time.time()
+        rows = [
+            (str(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now)
+            for key, value in items
+        ]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", rows)
+            if self.maxsize is not None:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.maxsize,),
+                )
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def make_cache(
+    path: Optional[str] = None,
+    maxsize: Optional[int] = 1024,
+    ttl: Optional[float] = None,
+) -> RevisionCache:
+    """Create a revision cache.
+
+    If ``path`` is given, the cache is stored in a SQLite database at that
+    path and shared between processes. Otherwise it is kept in memory.
+    """
+    if path:
+        return SQLiteRevisionCache(path, maxsize=maxsize, ttl=ttl)
+    return RevisionCache(maxsize=maxsize, ttl=ttl)
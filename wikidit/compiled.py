@@ -0,0 +1,221 @@
+"""Export the quality model for low-latency inference.
+
+A fitted model is exported to a directory with the native XGBoost model of
+each stage and a JSON manifest. :class:`CompiledModel` loads that directory
+with XGBoost, without unpickling the model with dill, and predicts from
+NumPy arrays with the boosters directly, skipping the input validation of
+scikit-learn. This requires XGBoost >= 1.4, which is newer than the XGBoost
+the packaged model is pickled with, so the model must be re-trained with it
+before it is exported.
+"""
+import json
+import os.path
+import re
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from .models import RevisionPreprocessor
+from .ordinal import SequentialClassifier, combine_log_probas
+
+_MANIFEST = "manifest.json"
+
+EXPORT_FORMATS = ("json", "ubj")
+"""File formats of the exported boosters."""
+
+_MIN_XGBOOST_VERSION = {"json": (1, 4), "ubj": (1, 6)}
+
+
+def _check_xgboost_version(format: str = "json") -> None:
+    """Raise ``RuntimeError`` if XGBoost is too old for ``format``."""
+    import xgboost
+
+    version = tuple(int(x) for x in re.findall(r"\d+", xgboost.__version__)[:2])
+    required = _MIN_XGBOOST_VERSION[format]
+    if version < required:
+        raise RuntimeError(
+            f"Exported models in the {format!r} format require XGBoost >= "
+            f"{'.'.join(map(str, required))}, but XGBoost {xgboost.__version__} "
+            "is installed"
+        )
+
+
+def _iteration_range(estimator) -> List[int]:
+    # Models fit with early stopping only predict with the best iteration
+    best_iteration = getattr(estimator, "best_iteration", None)
+    if best_iteration is None:
+        return [0, 0]
+    return [0, int(best_iteration) + 1]
+
+
+def export_model(model, path: str, format: str = "json") -> None:
+    """Export a fitted model to the directory ``path``.
+
+    Parameters
+    -----------
+    model:
+        A fitted XGBoost classifier or :class:`SequentialClassifier` of
+        XGBoost classifiers, optionally in a pipeline after a
+        :class:`RevisionPreprocessor`.
+    path:
+        The directory to write the model to.
+    format:
+        Format of the boosters, ``"json"`` or ``"ubj"`` (binary JSON, which
+        requires XGBoost >= 1.6).
+
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {EXPORT_FORMATS}, got {format!r}")
+    _check_xgboost_version(format)
+    steps = [x for _, x in model.steps] if hasattr(model, "steps") else [model]
+    *transforms, clf = steps
+    if any(not isinstance(x, RevisionPreprocessor) for x in transforms):
+        raise ValueError("Only a RevisionPreprocessor can precede the classifier")
+    if isinstance(clf, SequentialClassifier):
+        stages = clf.estimators_
+        classes = list(range(clf.n_classes_))
+    else:
+        stages = [clf]
+        classes = [x.item() if hasattr(x, "item") else x for x in clf.classes_]
+    for stage in stages:
+        if not hasattr(stage, "get_booster"):
+            raise TypeError(f"Cannot export {type(stage).__name__}, only XGBoost")
+    if transforms:
+        columns = RevisionPreprocessor.KEEP
+    else:
+        # The columns the classifier was fit with, if it was fit on a data frame
+        columns = getattr(clf, "feature_names_in_", None)
+        if columns is None:
+            columns = stages[0].get_booster().feature_names
+        columns = None if columns is None else [str(x) for x in columns]
+
+    os.makedirs(path, exist_ok=True)
+    manifest = {
+        "sequential": isinstance(clf, SequentialClassifier),
+        "classes": classes,
+        "preprocess": bool(transforms),
+        "columns": columns,
+        "stages": [],
+    }
+    for i, stage in enumerate(stages):
+        filename = f"stage-{i}.{format}"
+        stage.get_booster().save_model(os.path.join(path, filename))
+        manifest["stages"].append(
+            {"file": filename, "iteration_range": _iteration_range(stage)}
+        )
+    with open(os.path.join(path, _MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+class CompiledModel:
+    """A quality model exported with :func:`export_model`.
+
+    This has the ``predict_proba`` and ``predict`` methods of the original
+    model and gives the same probabilities.
+
+    Parameters
+    -----------
+    boosters:
+        The XGBoost booster of each stage.
+    manifest:
+        The manifest written by :func:`export_model`.
+
+    """
+
+    def __init__(self, boosters: List, manifest: Dict) -> None:
+        self.boosters = boosters
+        self.manifest = manifest
+        self.sequential = manifest["sequential"]
+        self.classes_ = np.array(manifest["classes"])
+        self._iteration_ranges = [
+            tuple(x["iteration_range"]) for x in manifest["stages"]
+        ]
+        self._preprocessor = None
+        if manifest["preprocess"]:
+            self._preprocessor = RevisionPreprocessor()
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledModel":
+        """Load a model from the directory ``path``."""
+        import xgboost
+
+        _check_xgboost_version()
+
+        with open(os.path.join(path, _MANIFEST), "r") as f:
+            manifest = json.load(f)
+        columns = manifest["columns"]
+        if manifest["preprocess"] and columns != RevisionPreprocessor.KEEP:
+            raise ValueError(f"The columns of the model in {path} have changed")
+        boosters = []
+        for stage in manifest["stages"]:
+            booster = xgboost.Booster(model_file=os.path.join(path, stage["file"]))
+            # Columns are passed by position, in the order of the manifest
+            booster.feature_names = None
+            boosters.append(booster)
+        return cls(boosters, manifest)
+
+    def _to_array(self, X) -> np.ndarray:
+        if isinstance(X, np.ndarray):
+            return np.asarray(X, dtype=np.float32)
+        if self._preprocessor is not None:
+            return self._preprocessor.to_array(X)
+        columns = self.manifest["columns"]
+        if columns is None:
+            # The classifier was fit on an array, so columns are positional
+            return np.asarray(X, dtype=np.float32)
+        if not isinstance(X, pd.DataFrame):
+            X = pd.DataFrame.from_records([X] if isinstance(X, dict) else X)
+        return X[columns].to_numpy(dtype=np.float32)
+
+    def _stage_proba(self, i: int, X: np.ndarray) -> np.ndarray:
+        prob = self.boosters[i].inplace_predict(
+            X, iteration_range=self._iteration_ranges[i]
+        )
+        if prob.ndim == 1:
+            # Binary classifiers only return the probability of the 2nd class
+            prob = np.vstack((1.0 - prob, prob)).transpose()
+        return prob
+
+    def predict_proba(self, X: Union[pd.DataFrame, Dict, List[Dict], np.ndarray]):
+        """Predict class probabilities.
+
+        ``X`` can be revisions in any form accepted by
+        :meth:`RevisionPreprocessor.transform`, or an array which has already
+        been preprocessed. If the model has no preprocessor, the columns of a
+        data frame are selected by name.
+        """
+        X = self._to_array(X)
+        if not self.sequential:
+            return self._stage_proba(0, X)
+        log_probas = [
+            np.log(self._stage_proba(i, X)) for i in range(len(self.boosters))
+        ]
+        return np.exp(combine_log_probas(log_probas))
+
+    def predict_from_proba(self, prob: np.ndarray) -> np.ndarray:
+        """Predict classes from probabilities computed by this model."""
+        if self.sequential:
+            # the median class, as in SequentialClassifier
+            return np.argmax(np.cumsum(prob, axis=1) >= 0.5, axis=1)
+        return self.classes_[np.argmax(prob, axis=1)]
+
+    def predict(self, X: Union[pd.DataFrame, Dict, List[Dict], np.ndarray]):
+        """Predict classes."""
+        return self.predict_from_proba(self.predict_proba(X))
+
+
+def check_model(model, compiled: CompiledModel, X, rtol=1e-5, atol=1e-6) -> None:
+    """Check that an exported model predicts like the original model.
+
+    Raises ``ValueError`` if the probabilities predicted by ``compiled`` for
+    the revisions ``X`` are not close to those of ``model``, as in
+    :func:`numpy.allclose`.
+    """
+    expected = model.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    if not np.allclose(actual, expected, rtol=rtol, atol=atol):
+        diff = np.max(np.abs(actual - expected))
+        raise ValueError(
+            f"The exported model differs from the model by up to {diff:g}"
+        )
@@ -2,12 +2,19 @@ import json
 import gzip
 import os.path
 import os
+from typing import Dict, List, Optional
 
 import pandas as pd
 from joblib import Parallel, delayed
 
 from .preprocessing import WP10_DTYPE
 
+TEXT_COLUMNS = ("wikitext", "text")
+"""Columns with the text of revisions, which are stored separately in Parquet."""
+
+ID_COLUMN = "revid"
+"""Column used to join features and text stored in Parquet."""
+
 
 def load_ndjson(file):
     """Load lines from new-line delimited JSON file"""
@@ -33,11 +40,85 @@ def read_labeled_one(filename):
     return pd.DataFrame.from_records(out)
 
 
-def read_labeled(dirname, n_jobs=6):
-    """Read all labeled revisions files and concatenate into a single data frame"""
-    filenames = [os.path.join(dirname, f) for f in os.listdir(dirname)]
-    revisions = pd.concat(
-        Parallel(n_jobs=6)(delayed(read_labeled_one)(f) for f in filenames)
-    )
-    revisions["wp10"] = pd.Series(revisions["wp10"], dtype=WP10_DTYPE)
+def write_labeled_parquet(rows: List[Dict], dirname: str, part: int) -> None:
+    """Write a chunk of labeled revisions as Parquet files.
+
+    The features and metadata are written to
+    ``{dirname}/features/part-{part}.parquet``. The text columns, which are
+    much larger and rarely needed, are written with the revision ids to
+    ``{dirname}/text/part-{part}.parquet``. This requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = pd.DataFrame.from_records(rows)
+    text_columns = [ID_COLUMN, *(c for c in TEXT_COLUMNS if c in df.columns)]
+    for subdir, data in (
+        ("features", df.drop(columns=text_columns[1:])),
+        ("text", df[text_columns]),
+    ):
+        os.makedirs(os.path.join(dirname, subdir), exist_ok=True)
+        filename = os.path.join(dirname, subdir, f"part-{part:05d}.parquet")
+        # Write to a temporary file first so that a part is either complete
+        # or missing, e.g. if a run is interrupted.
+        pq.write_table(
+            pa.Table.from_pandas(data, preserve_index=False), filename + ".tmp"
+        )
+        os.replace(filename + ".tmp", filename)
+
+
+def read_labeled_parquet(
+    dirname: str, columns: Optional[List[str]] = None, text: bool = False
+) -> pd.DataFrame:
+    """Read labeled revisions written by :func:`write_labeled_parquet`.
+
+    Parameters
+    -----------
+    dirname:
+        Directory with the Parquet files.
+    columns:
+        Columns to read. If ``None``, all columns are read. Only these columns
+        are read from disk.
+    text:
+        If true, read the text files instead of the features.
+
+    """
+    import pyarrow.parquet as pq
+
+    subdir = os.path.join(dirname, "text" if text else "features")
+    filenames = sorted(f for f in os.listdir(subdir) if f.endswith(".parquet"))
+    # Read each part separately since columns which are all missing in one
+    # part can have a different type than in other parts. Parts are memory
+    # mapped rather than copied into buffers before decoding.
+    frames = [
+        pq.read_table(
+            os.path.join(subdir, f), columns=columns, memory_map=True
+        ).to_pandas()
+        for f in filenames
+    ]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def read_labeled(dirname, n_jobs=6, columns=None):
+    """Read all labeled revisions files and concatenate into a single data frame
+
+    ``dirname`` can contain gzipped NDJSON files, ``*.ndjson.gz``, or Parquet
+    files written by :func:`write_labeled_parquet`. For Parquet files, only
+    ``columns`` are read, if given.
+    """
+    if os.path.isdir(os.path.join(dirname, "features")):
+        revisions = read_labeled_parquet(dirname, columns=columns)
+    else:
+        filenames = [
+            os.path.join(dirname, f)
+            for f in os.listdir(dirname)
+            if f.endswith(".ndjson.gz")
+        ]
+        revisions = pd.concat(
+            Parallel(n_jobs=n_jobs)(delayed(read_labeled_one)(f) for f in filenames)
+        )
+        if columns is not None:
+            revisions = revisions[columns]
+    if "wp10" in revisions:
+        revisions["wp10"] = pd.Series(revisions["wp10"], dtype=WP10_DTYPE)
     return revisions
@@ -0,0 +1,251 @@
+"""Timers and counters of the stages of serving a page.
+
+Stages, e.g. the requests to the MediaWiki API, parsing, counting words, and
+scoring, are timed with :func:`timer`. The times are collected in latency
+histograms and, for the request being served by the current thread, as
+per-request timings which the app sends in a ``Server-Timing`` header.
+Everything is rendered in the Prometheus text format by :func:`render`.
+
+Metrics are disabled unless the ``WIKIDIT_METRICS`` environment variable is
+set or :func:`enable` is called. While disabled, :func:`timer` returns a
+shared context manager which does nothing, so timed code only pays for a
+function call. Metrics are kept per process; each worker of a gunicorn
+server reports its own.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+ENABLED = bool(os.environ.get("WIKIDIT_METRICS"))
+"""Whether metrics are collected."""
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds, in seconds, of the buckets of the latency histograms."""
+
+STAGE_SECONDS = "wikidit_stage_seconds"
+
+_HELP = {
+    STAGE_SECONDS: "Time spent in each stage of serving a page.",
+    "wikidit_request_seconds": "Time spent serving each endpoint.",
+    "wikidit_upstream_requests_total": "Requests to the MediaWiki API.",
+    "wikidit_upstream_errors_total": "Requests to the MediaWiki API which failed.",
+    "wikidit_batches_total": "Batches of rows scored by the model.",
+    "wikidit_batched_rows_total": "Rows scored in batches by the model.",
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """A histogram of observations with cumulative ``buckets``."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        out = []
+        total = 0
+        for n in self.counts:
+            total += n
+            out.append(total)
+        return out
+
+
+_histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+_counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+
+
+def enable(enabled: bool = True) -> None:
+    """Turn the collection of metrics on or off."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset() -> None:
+    """Discard all collected metrics."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Add an observation to the histogram ``name``."""
+    if not ENABLED:
+        return
+    key = _labels(labels)
+    with _lock:
+        hist = _histograms[name].get(key)
+        if hist is None:
+            hist = _histograms[name][key] = Histogram()
+        hist.observe(value)
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    """Increment the counter ``name``."""
+    if not ENABLED:
+        return
+    key = _labels(labels)
+    with _lock:
+        counter = _counters[name]
+        counter[key] = counter.get(key, 0) + value
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.start
+        observe(STAGE_SECONDS, elapsed, stage=self.stage)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str):
+    """Time the ``with`` block as the stage ``stage``.
+
+    The time is added to the ``wikidit_stage_seconds`` histogram and to the
+    timings of the current request. Repeated stages in a request, e.g. two
+    API requests, are added together.
+    """
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(stage)
+
+
+def start_request() -> None:
+    """Start collecting the stage timings of a request in this thread."""
+    if ENABLED:
+        _local.timings = {}
+
+
+def end_request() -> Dict[str, float]:
+    """Stop collecting and return the stage timings of the request."""
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings or {}
+
+
+def bind_request(func: Callable) -> Callable:
+    """Add the stage timings of ``func`` to the request of the current thread.
+
+    Use this to wrap functions submitted to another thread, e.g. an executor,
+    on behalf of a request. The stages timed in ``func`` are added to the
+    timings of the request when ``func`` returns, so those of a call which
+    is still running when the request ends are not included.
+    """
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "timings", None)
+        _local.timings = {}
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with _lock:
+                for stage, elapsed in _local.timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + elapsed
+            _local.timings = previous
+
+    return wrapper
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format stage timings, in seconds, as a ``Server-Timing`` header."""
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
+
+
+def _format_labels(labels: Labels, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _header(lines: List[str], name: str, kind: str) -> None:
+    help_text = _HELP.get(name, name)
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render(extra: Optional[Dict[str, Tuple[str, str, float]]] = None) -> str:
+    """Render the metrics in the Prometheus text format.
+
+    Parameters
+    -----------
+    extra:
+        Other metrics of the app, as ``{name: (type, help, value)}``, e.g.
+        the hit and miss counts of the prediction cache.
+
+    """
+    lines = []
+    with _lock:
+        for name, series in sorted(_histograms.items()):
+            _header(lines, name, "histogram")
+            for labels, hist in sorted(series.items()):
+                for upper, n in zip(hist.buckets, hist.cumulative_counts()):
+                    le = _format_labels(labels, le=f"{upper:g}")
+                    lines.append(f"{name}_bucket{le} {n}")
+                le = _format_labels(labels, le="+Inf")
+                lines.append(f"{name}_bucket{le} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        for name, series in sorted(_counters.items()):
+            _header(lines, name, "counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    for name, (kind, help_text, value) in sorted((extra or {}).items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -1,14 +1,22 @@
 """Classes and methods for fitting and predicting models."""
-from typing import List, Dict, Tuple
+from typing import (
+    Any, Callable, Iterable, List, Dict, NamedTuple, Optional, Tuple, Union)
+import hashlib
+import itertools
+import os
 import os.path
 
 import pandas as pd
 import numpy as np
-import dill
+from joblib import Parallel, delayed, effective_n_jobs
+from mwxml import Revision
 from sklearn.base import BaseEstimator, TransformerMixin
 
-from .mw import Session, get_page
+from . import metrics
+from .mw import Session, default_session, get_page, get_pages
+from .ordinal import SequentialClassifier
 from .preprocessing import Featurizer, WP10_LABELS
+from .utils import lazy
 
 _MODEL_FILE = 'xgboost-sequential.pkl'
 _MODEL_PATH = os.path.join(os.path.dirname(__file__), _MODEL_FILE)
@@ -48,16 +56,178 @@ class RevisionPreprocessor(BaseEstimator, TransformerMixin):
     ]
     """Names of columns to keep"""
 
+    _COUNT_COLS = KEEP[: -len(PER_WORD_COLS) - len(BINARY_COLS)]
+
+    INPUT_COLS = [*_COUNT_COLS, *BINARY_COLS]
+    """Names of the columns used from the input."""
+
     def fit(self, X: Dict, y=None):
         """Does nothing."""
         return self
 
-    def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
-        for feat in self.PER_WORD_COLS:
-            X[f"{feat}_per_word"] = X[feat] / X["words"]
-        for feat in self.BINARY_COLS:
-            X[feat] = X[feat].astype(bool).astype(int)
-        return X[self.KEEP]
+    def transform(
+        self, X: Union[pd.DataFrame, Dict, List[Dict]], y=None
+    ) -> pd.DataFrame:
+        """Select the columns in ``KEEP`` and add the per word columns.
+
+        ``X`` can be a data frame, a list of revisions as dicts, or a single
+        revision as a dict. It is not modified. See :meth:`to_array`.
+        """
+        return pd.DataFrame(self.to_array(X), columns=self.KEEP, copy=False)
+
+    def to_array(self, X: Union[pd.DataFrame, Dict, List[Dict]]) -> np.ndarray:
+        """Transform revisions to a float32 array with the columns in ``KEEP``.
+
+        The columns are written into one preallocated array, and all per word
+        columns are computed with a single division.
+        """
+        if isinstance(X, dict):
+            X = [X]
+        counts = self._COUNT_COLS
+        n = len(counts)
+        m = len(self.PER_WORD_COLS)
+        out = np.empty((len(X), len(self.KEEP)), dtype=np.float32)
+        if isinstance(X, pd.DataFrame):
+            for j, col in enumerate(counts):
+                out[:, j] = X[col].to_numpy()
+            for j, col in enumerate(self.BINARY_COLS, start=n + m):
+                out[:, j] = X[col].to_numpy().astype(bool)
+        else:
+            for i, row in enumerate(X):
+                out[i, :n] = [row[col] for col in counts]
+                out[i, n + m :] = [bool(row[col]) for col in self.BINARY_COLS]
+        # The per word columns follow the counts they are computed from
+        np.divide(out[:, n - m : n], out[:, :1], out=out[:, n : n + m])
+        return out
+
+
+class Edit(NamedTuple):
+    """An edit which changes the features of a revision.
+
+    Parameters
+    -----------
+    name:
+        Name of the edit.
+    deltas:
+        Change in each feature for one unit of the edit.
+    description:
+        HTML description shown to users.
+    effort:
+        Effort of one unit of the edit. Edits are ranked by the expected
+        gain in quality per unit of effort. The edits in ``EDITS`` all have
+        an effort of 1, so they are ranked by the gain alone; set the
+        efforts, e.g. with :meth:`_replace`, to rank them otherwise.
+    magnitudes:
+        Numbers of units of the edit which are evaluated.
+
+    """
+
+    name: str
+    deltas: Dict[str, float]
+    description: str
+    effort: float = 1.0
+    magnitudes: Tuple[int, ...] = (1,)
+
+
+EDITS = [
+    Edit("sentence", {"words": 15}, "Add a sentence (15 words)"),
+    Edit("paragraph", {"words": 150}, "Add a paragraph (150 words)"),
+    Edit(
+        "headings",
+        {"headings": 1, "words": 2},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style#'
+        'Article_titles,_headings,_and_sections">Organize the article with a '
+        "heading</a>",
+    ),
+    Edit(
+        "sub_headings",
+        {"sub_headings": 1, "words": 2},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style#'
+        'Article_titles,_headings,_and_sections">Organize the article with a '
+        "sub-heading</a>",
+    ),
+    Edit(
+        "images",
+        {"images": 1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Images">'
+        "Add an image</a>",
+    ),
+    Edit(
+        "categories",
+        {"categories": 1, "words": 2},
+        '<a href="https://en.wikipedia.org/wiki/Help:Category">Add another'
+        " category.</a>",
+    ),
+    Edit(
+        "wikilinks",
+        {"wikilinks": 1, "words": 1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:External_links">'
+        "Add a link to another page in Wikipedia</a>",
+    ),
+    Edit(
+        "external_links",
+        {"external_links": 1, "words": 1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:External_links">'
+        "Add an external link</a>",
+    ),
+    Edit(
+        "citation",
+        {"cite_templates": 1, "words": 5},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Citing_sources">Add a '
+        "citation</a>",
+    ),
+    Edit(
+        "ref",
+        {"ref": 1, "words": 15},
+        '<a href="https://en.wikipedia.org/wiki/Help:Footnotes#'
+        'Footnotes:_the_basics">Add a footnote</a>',
+    ),
+    Edit(
+        "coordinates",
+        {"coordinates": 1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:'
+        'WikiProject_Geographical_coordinates#Coordinate_templates">'
+        "Add coordinates.</a>",
+    ),
+    Edit(
+        "infoboxes",
+        {"infoboxes": 1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/'
+        'Infoboxes">'
+        "Add an infobox</a>",
+    ),
+    Edit(
+        "backlog_accuracy",
+        {"backlog_accuracy": -1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
+        "Fix a backlog issue related to accuracy</a>",
+    ),
+    Edit(
+        "backlog_other",
+        {"backlog_other": -1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
+        "Fix a backlog issue in the other category</a>",
+    ),
+    Edit(
+        "backlog_style",
+        {"backlog_style": -1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
+        "Fix a backlog issue relating to style</a>",
+    ),
+    Edit(
+        "backlog_links",
+        {"backlog_links": -1},
+        '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
+        "Fix a backlog issue relating to links</a>",
+    ),
+]
+"""Edits recommended to users."""
+
+
+def _revision_vector(revision: Dict) -> np.ndarray:
+    return np.array(
+        [revision[col] for col in RevisionPreprocessor.INPUT_COLS], dtype=np.float32
+    )
 
 
 def add_count(x: Dict, col: str, i: int) -> Dict:
@@ -100,149 +270,242 @@ def add_per_word(x: Dict, col: str, i: int, w: int) -> Dict:
         A copy of ``x`` with the appropriate changes. This does not
         alter ``x`` in place.
     """
-    x = add_words(x, w)
-    x[col] += i
-    x[col] = max(x[col], 0)
-    return x
+    return add_count(add_words(x, w), col, i)
 
 
 def add_binary(x: Dict, col: str) -> Dict:
-    ""
+    """Set the binary variable ``x[col]``."""
     x = x.copy()
-    x[col] = bool(x[col]) or True
+    x[col] = True
     return x
 
 
-def make_edits(page: Dict) -> List[Tuple[str, Dict, str]]:
-    return [
-        ("sentence", add_words(page, 15), "Add a sentence (15 words)"),
-        ("paragraph", add_words(page, 150), "Add a paragraph (150 words)"),
-        (
-            "headings",
-            add_per_word(page, "headings", 1, 2),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style#'
-            'Article_titles,_headings,_and_sections">Organize the article with a '
-            "heading</a>",
-        ),
-        (
-            "sub_headings",
-            add_per_word(page, "sub_headings", 1, 2),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style#'
-            'Article_titles,_headings,_and_sections">Organize the article with a '
-            "sub-heading</a>",
-        ),
-        (
-            "images",
-            add_per_word(page, "images", 1, 0),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Images">'
-            "Add an image</a>",
-        ),
-        (
-            "categories",
-            add_per_word(page, "categories", 1, 2),
-            '<a href="https://en.wikipedia.org/wiki/Help:Category">Add another'
-            " category.</a>",
-        ),
-        (
-            "wikilinks",
-            add_per_word(page, "wikilinks", 1, 1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:External_links">'
-            "Add a link to another page in Wikipedia</a>",
-        ),
-        (
-            "external_links",
-            add_per_word(page, "external_links", 1, 1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:External_links">'
-            "Add an external link</a>",
-        ),
-        (
-            "citation",
-            add_per_word(page, "cite_templates", 1, 5),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Citing_sources">Add a '
-            "citation</a>",
-        ),
-        (
-            "ref",
-            add_per_word(page, "ref", 1, 15),
-            '<a href="https://en.wikipedia.org/wiki/Help:Footnotes#'
-            'Footnotes:_the_basics">Add a footnote</a>',
-        ),
-        (
-            "coordinates",
-            add_binary(page, "coordinates"),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:'
-            'WikiProject_Geographical_coordinates#Coordinate_templates">'
-            "Add coordinates.</a>",
-        ),
-        (
-            "infoboxes",
-            add_binary(page, "infoboxes"),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/'
-            'Infoboxes">'
-            "Add an infobox</a>",
-        ),
-        (
-            "backlog_accuracy",
-            add_count(page, "backlog_accuracy", -1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
-            "Fix a backlog issue related to accuracy</a>",
-        ),
-        (
-            "backlog_other",
-            add_count(page, "backlog_other", -1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
-            "Fix a backlog issue in the other category</a>",
-        ),
-        (
-            "backlog_style",
-            add_count(page, "backlog_style", -1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
-            "Fix a backlog issue relating to style</a>",
-        ),
-        (
-            "backlog_links",
-            add_count(page, "backlog_links", -1),
-            '<a href="https://en.wikipedia.org/wiki/Wikipedia:Backlog">'
-            "Fix a backlog issue relating to links</a>",
-        ),
-    ]
+def apply_edit(x: Dict, edit: Edit, magnitude: int = 1) -> Dict:
+    """Apply ``magnitude`` units of ``edit`` to a revision ``x``.
+
+    This gives the same features as the rows of :func:`edit_grid`, as a copy
+    of ``x``, which is not altered in place.
+    """
+    for col, delta in edit.deltas.items():
+        if col == "words":
+            x = add_words(x, delta * magnitude)
+        elif col in RevisionPreprocessor.BINARY_COLS:
+            x = add_binary(x, col)
+        else:
+            x = add_count(x, col, delta * magnitude)
+    return x
+
+
+def make_edits(page: Dict, edits: List[Edit] = EDITS) -> List[Tuple[str, Dict, str]]:
+    """Apply each of ``edits`` to a revision.
+
+    Returns the name, the edited copy of ``page``, and the description of
+    each edit. :func:`predict_page_edits` applies all edits at once with
+    :func:`edit_grid` instead.
+    """
+    return [(edit.name, apply_edit(page, edit), edit.description) for edit in edits]
+
+
+def edit_grid(
+    edits: List[Edit] = EDITS, magnitudes: Optional[Tuple[int, ...]] = None
+) -> Tuple[np.ndarray, List[Tuple[Edit, int]]]:
+    """Create the changes in the features for a grid of edits.
+
+    Parameters
+    -----------
+    edits:
+        The edits.
+    magnitudes:
+        Numbers of units of every edit to evaluate. If ``None``, the
+        ``magnitudes`` of each edit are used.
+
+    Returns
+    --------
+    tuple:
+        An array with the change in each of ``RevisionPreprocessor.INPUT_COLS``
+        with one row per edit and magnitude, and the edit and magnitude of
+        each row.
+
+    """
+    columns = {col: j for j, col in enumerate(RevisionPreprocessor.INPUT_COLS)}
+    grid = [(edit, m) for edit in edits for m in (magnitudes or edit.magnitudes)]
+    deltas = np.zeros((len(grid), len(columns)), dtype=np.float32)
+    for i, (edit, m) in enumerate(grid):
+        for col, delta in edit.deltas.items():
+            deltas[i, columns[col]] = delta * m
+    return deltas, grid
+
+
+# Revisions always have at least one word, and counts cannot be negative
+_LOWER = np.array(
+    [1 if col == "words" else 0 for col in RevisionPreprocessor.INPUT_COLS],
+    dtype=np.float32,
+)
+
+
+def _apply_edits(x: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+    """Revision ``x`` followed by ``x`` after each edit, as one array."""
+    rows = np.empty((len(deltas) + 1, len(x)), dtype=np.float32)
+    rows[0] = x
+    np.add(x, deltas, out=rows[1:])
+    np.maximum(rows[1:], _LOWER, out=rows[1:])
+    return rows
+
+
+def _predict_rows(rows: np.ndarray, model) -> np.ndarray:
+    return model.predict_proba(
+        pd.DataFrame(rows, columns=RevisionPreprocessor.INPUT_COLS, copy=False)
+    )
 
 
 def predict_page_edits_api(
-    title, model, mapper, featurizer=Featurizer(), session=Session()
+    title: str,
+    model,
+    mapper: Optional[Callable[[Dict], Any]] = None,
+    featurizer: Optional[Featurizer] = None,
+    session: Optional[Session] = None,
 ):
-    page = get_page(title, session)
-    return predict_page_edits(page["content"], featurizer, model)
+    """Predict the quality and edits of the current revision of a page.
+
+    Parameters
+    -----------
+    title:
+        Title of the page.
+    model:
+        The quality prediction model.
+    mapper:
+        Function applied to the result of :func:`predict_page_edits`, e.g.
+        to keep only the values needed by a response. If ``None``, the
+        result is returned as is.
+    featurizer:
+        The featurizer. If ``None``, a :class:`Featurizer` with the default
+        options is used.
+    session:
+        The API session. If ``None``, :func:`wikidit.mw.default_session` is
+        used.
+
+    Returns
+    --------
+    The result, or ``None`` if the page does not exist.
+
+    """
+    page = get_page(title, session or default_session())
+    if page is None:
+        return None
+    result = predict_page_edits(page["content"], featurizer or Featurizer(), model)
+    return result if mapper is None else mapper(result)
 
 
 def qual_score(prob: np.array) -> float:
     return (prob * np.arange(prob.shape[1])).sum()
 
 
-def predict_page_edits(content: str, featurizer: Featurizer, model) -> Dict:
-    revision = featurizer.parse_content(content)
+def qual_scores(prob: np.array) -> np.array:
+    """Expected quality class for each row of a probability matrix."""
+    return prob @ np.arange(prob.shape[1])
+
 
+def predict_from_proba(model, prob: np.array) -> np.array:
+    """Predict classes from probabilities already computed by ``model``.
+
+    This gives the same result as ``model.predict`` without scoring the rows
+    a second time. :class:`SequentialClassifier` predicts the median class,
+    other classifiers predict the modal class.
+    """
+    if hasattr(model, "predict_from_proba"):
+        return model.predict_from_proba(prob)
+    estimator = model.steps[-1][1] if hasattr(model, "steps") else model
+    if isinstance(estimator, SequentialClassifier):
+        return np.argmax(np.cumsum(prob, axis=1) >= 0.5, axis=1)
+    return estimator.classes_[np.argmax(prob, axis=1)]
+
+
+def page_edit_rows(
+    content: str, featurizer: Featurizer, edits: List[Edit] = EDITS
+) -> Tuple[np.ndarray, bool]:
+    """Featurize a revision and apply each edit in ``edit_grid(edits)`` to it.
+
+    Returns the rows to score, the current revision first and then each
+    edit, and whether the features are approximate.
+    """
+    revision, rows = _page_revision_rows(content, featurizer, edits)
+    return rows, revision.get("approximate", False)
+
+
+def _page_revision_rows(
+    content: str, featurizer: Featurizer, edits: List[Edit]
+) -> Tuple[Dict, np.ndarray]:
+    with metrics.timer("featurize"):
+        revision = featurizer.parse_content(content)
     del revision["text"]
-    revision_df = pd.DataFrame.from_records([revision])
+    deltas, _ = edit_grid(edits)
+    return revision, _apply_edits(_revision_vector(revision), deltas)
+
+
+def predict_page_edits(
+    content: str, featurizer: Featurizer, model, edits: List[Edit] = EDITS
+) -> Dict:
+    # The current revision is the first row and each edit is a subsequent
+    # row, so that everything is scored with one model call.
+    revision, rows = _page_revision_rows(content, featurizer, edits)
+    with metrics.timer("score"):
+        probs = _predict_rows(rows, model)
+    approximate = revision.get("approximate", False)
+    return page_edit_results(rows, probs, model, approximate, edits, revision)
+
+
+def page_edit_results(
+    rows: np.ndarray,
+    probs: np.ndarray,
+    model,
+    approximate: bool = False,
+    edits: List[Edit] = EDITS,
+    revision: Optional[Dict] = None,
+) -> Dict:
+    """Create the results of :func:`predict_page_edits` from scored rows.
+
+    ``rows`` are from :func:`page_edit_rows` and ``probs`` are their class
+    probabilities predicted by ``model``. If the features of the current
+    ``revision`` are given, the frames in ``"edits"`` have all of its
+    columns, with the edited values, rather than only the model inputs.
+    """
+    _, grid = edit_grid(edits)
+    scores = qual_scores(probs)
 
     # probabilities for current class
-    prob = model.predict_proba(revision_df)
-    best = model.predict(revision_df)[0]
-    score = qual_score(prob)
-
-    # Calc new probabilities for all types of edits
-    edits = [
-        (nm, description, pd.DataFrame.from_records([x]))
-        for nm, x, description in make_edits(revision_df.to_dict("records")[0])
+    prob = probs[:1]
+    best = predict_from_proba(model, prob)[0]
+    score = scores[0]
+
+    names = [edit.name for edit, _ in grid]
+    descriptions = [edit.description for edit, _ in grid]
+    if revision is None:
+        frame = pd.DataFrame(
+            rows, columns=RevisionPreprocessor.INPUT_COLS, copy=False
+        )
+    else:
+        frame = pd.DataFrame.from_records([revision] * len(rows))
+        frame[RevisionPreprocessor.INPUT_COLS] = rows
+    edit_rows = [
+        (nm, description, frame.iloc[[i]].reset_index(drop=True))
+        for i, (nm, description) in enumerate(zip(names, descriptions), start=1)
     ]
     edit_probs = [
-        (nm, description, model.predict_proba(ed)) for nm, description, ed in edits
+        (nm, description, probs[[i]])
+        for i, (nm, description) in enumerate(zip(names, descriptions), start=1)
     ]
-    edit_scores = [
-        (nm, description, qual_score(p)) for nm, description, p in edit_probs
+    edit_scores = list(zip(names, descriptions, scores[1:]))
+    changes = scores[1:] - score
+    # Edits which do not change the features, e.g. removing backlog templates
+    # from a page with none, cannot change the score. Their rows can still
+    # differ by rounding when they are scored in a larger batch.
+    changes[(rows[1:] == rows[0]).all(axis=1)] = 0
+    efforts = np.array([edit.effort * m for edit, m in grid])
+    # Rank the edits which improve the article by the gain per unit of effort
+    order = np.argsort(-changes / efforts, kind="stable")
+    top_edits = [
+        (names[i], descriptions[i], changes[i]) for i in order if changes[i] > 0
     ]
-    edit_changes = [(n, d, s - score) for n, d, s in edit_scores]
-    top_edits = sorted([x for x in edit_changes if x[2] > 0], key=lambda x: -x[2])
 
     return {
         "prob": list(zip(list(WP10_LABELS), list(prob.ravel()))),
@@ -250,13 +513,383 @@ def predict_page_edits(content: str, featurizer: Featurizer, model) -> Dict:
         "edit_probs": edit_probs,
         "edit_scores": edit_scores,
         "top_edits": top_edits,
-        "edits": edits,
+        "edits": edit_rows,
         "best": WP10_LABELS[best],
+        "approximate": approximate,
     }
 
 
-def load_model():
-    """Load the trained quality prediction model."""
-    with open(_MODEL_PATH, 'rb') as f:
+def score_edits(
+    revision: Dict,
+    model,
+    edits: List[Edit] = EDITS,
+    magnitudes: Optional[Tuple[int, ...]] = None,
+) -> pd.DataFrame:
+    """Predict the change in quality from a grid of edits to a revision.
+
+    All edits are scored with one model call.
+
+    Parameters
+    -----------
+    revision:
+        The features of the revision.
+    model:
+        The quality prediction model.
+    edits:
+        The edits.
+    magnitudes:
+        Numbers of units of every edit to evaluate, e.g. ``(1, 2, 3)``. If
+        ``None``, the ``magnitudes`` of each edit are used.
+
+    Returns
+    --------
+    pd.DataFrame
+        The name, description, magnitude, and effort of each edit, the
+        expected quality after the edit (``score``), and the change in the
+        expected quality (``gain``), sorted by the gain per unit of effort.
+
+    """
+    deltas, grid = edit_grid(edits, magnitudes)
+    scores = qual_scores(
+        _predict_rows(_apply_edits(_revision_vector(revision), deltas), model)
+    )
+    out = pd.DataFrame(
+        {
+            "name": [edit.name for edit, _ in grid],
+            "description": [edit.description for edit, _ in grid],
+            "magnitude": [m for _, m in grid],
+            "effort": [edit.effort * m for edit, m in grid],
+            "score": scores[1:],
+            "gain": scores[1:] - scores[0],
+        }
+    )
+    out["gain_per_effort"] = out["gain"] / out["effort"]
+    return out.sort_values("gain_per_effort", ascending=False, kind="stable")
+
+
+def plan_edits(
+    revision: Dict,
+    model,
+    steps: int = 3,
+    edits: List[Edit] = EDITS,
+    magnitudes: Optional[Tuple[int, ...]] = None,
+) -> List[Dict]:
+    """Plan a sequence of edits which improve a revision.
+
+    At each step, every edit is applied to the revision resulting from the
+    previous steps, and the edit with the largest gain per unit of effort is
+    chosen. Each step scores all edits with one model call. The plan stops
+    early if no edit improves the expected quality.
+
+    Parameters
+    -----------
+    revision:
+        The features of the revision.
+    model:
+        The quality prediction model.
+    steps:
+        Maximum number of edits.
+    edits:
+        The edits.
+    magnitudes:
+        Numbers of units of every edit to evaluate. If ``None``, the
+        ``magnitudes`` of each edit are used.
+
+    Returns
+    --------
+    list
+        For each step, a dict with the name, description, and magnitude of
+        the edit, the expected quality after the edit (``score``), and the
+        change in the expected quality (``gain``).
+
+    """
+    deltas, grid = edit_grid(edits, magnitudes)
+    efforts = np.array([edit.effort * m for edit, m in grid])
+    x = _revision_vector(revision)
+    plan = []
+    for _ in range(steps):
+        rows = _apply_edits(x, deltas)
+        scores = qual_scores(_predict_rows(rows, model))
+        gains = scores[1:] - scores[0]
+        i = np.argmax(gains / efforts)
+        if gains[i] <= 0:
+            break
+        edit, magnitude = grid[i]
+        plan.append(
+            {
+                "name": edit.name,
+                "description": edit.description,
+                "magnitude": magnitude,
+                "score": scores[i + 1],
+                "gain": gains[i],
+            }
+        )
+        x = rows[i + 1]
+    return plan
+
+
+def _featurize_contents(contents: List[str], word_counter: str) -> List[Dict]:
+    featurizer = Featurizer(word_counter=word_counter)
+    out = []
+    for content in contents:
+        revision = featurizer.parse_content(content)
+        del revision["text"]
+        out.append(revision)
+    return out
+
+
+def score_revisions(
+    contents: List[str], model, n_jobs: int = 1, word_counter: str = "spacy"
+) -> pd.DataFrame:
+    """Predict the quality of many revisions.
+
+    The revisions are featurized in parallel and scored with a single model
+    call.
+
+    Parameters
+    -----------
+    contents:
+        The content of each revision.
+    model:
+        The quality prediction model.
+    n_jobs:
+        Number of jobs used to featurize revisions. Negative values count
+        back from the number of CPUs, as in joblib.
+    word_counter:
+        Method used to count words. See :class:`Featurizer`.
+
+    Returns
+    --------
+    pd.DataFrame
+        A data frame with the features, the predicted class (``best``),
+        the expected quality (``score``), and the probability of each class,
+        with one row per revision.
+
+    """
+    if not contents:
+        return pd.DataFrame()
+    # Negative n_jobs, e.g. -1 for all CPUs, are resolved as by joblib
+    n_jobs = effective_n_jobs(n_jobs)
+    batches = np.array_split(np.arange(len(contents)), min(n_jobs, len(contents)))
+    features = Parallel(n_jobs=n_jobs)(
+        delayed(_featurize_contents)([contents[i] for i in idx], word_counter)
+        for idx in batches
+    )
+    revisions = pd.DataFrame.from_records([x for batch in features for x in batch])
+    return _add_predictions(revisions, model)
+
+
+def _add_predictions(
+    revisions: pd.DataFrame, model, probs: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    if probs is None:
+        probs = model.predict_proba(revisions)
+    return revisions.assign(
+        best=[WP10_LABELS[i] for i in predict_from_proba(model, probs)],
+        score=qual_scores(probs),
+        **{f"prob_{label}": probs[:, i] for i, label in enumerate(WP10_LABELS)},
+    )
+
+
+def score_history(
+    revisions: Iterable[Revision], model=None, word_counter: str = "spacy"
+) -> pd.DataFrame:
+    """Predict the quality of every revision in page histories.
+
+    The revisions of each page are featurized with
+    :meth:`Featurizer.iter_history`, which only parses the sections changed
+    by each edit, and all revisions are scored with a single model call.
+
+    Parameters
+    -----------
+    revisions:
+        Revisions ordered by page and time, e.g. from
+        :func:`wikidit.mw.iter_revisions`. Revisions with deleted text are
+        skipped.
+    model:
+        The quality prediction model. If ``None``, the trained model is used.
+    word_counter:
+        Method used to count words. See :class:`Featurizer`.
+
+    Returns
+    --------
+    pd.DataFrame
+        A data frame with the revision id, timestamp, page id and title, the
+        features, the predicted class (``best``), the expected quality
+        (``score``), and the probability of each class, with one row per
+        revision.
+
+    """
+    if model is None:
+        model = get_model()
+    featurizer = Featurizer(word_counter=word_counter)
+    rows = []
+    revisions = (rev for rev in revisions if rev.text is not None)
+    for _, page_revisions in itertools.groupby(revisions, key=lambda x: x.page.id):
+        # Stream the revisions rather than holding the texts of a whole history
+        page_revisions, texts = itertools.tee(page_revisions)
+        features = featurizer.iter_history(rev.text for rev in texts)
+        for rev, revision in zip(page_revisions, features):
+            rows.append(
+                {
+                    "rev_id": rev.id,
+                    "timestamp": str(rev.timestamp),
+                    "page_id": rev.page.id,
+                    "page_title": rev.page.title,
+                    **revision,
+                }
+            )
+    if not rows:
+        return pd.DataFrame()
+    return _add_predictions(pd.DataFrame.from_records(rows), model)
+
+
+def score_titles(
+    titles: List[str],
+    model=None,
+    session: Optional[Session] = None,
+    n_jobs: int = 1,
+    word_counter: str = "spacy",
+    scorer: Optional[Callable[[List[str]], pd.DataFrame]] = None,
+) -> List[Dict]:
+    """Predict the quality of the current revisions of many pages.
+
+    Pages are retrieved in batches, featurized in parallel, and scored with
+    a single model call.
+
+    Parameters
+    -----------
+    titles:
+        Titles of the pages.
+    model:
+        The quality prediction model. If ``None``, the trained model is used.
+    session:
+        The API session. If ``None``, :func:`wikidit.mw.default_session` is
+        used.
+    n_jobs:
+        Number of jobs used to featurize revisions. Negative values count
+        back from the number of CPUs, as in joblib.
+    word_counter:
+        Method used to count words. See :class:`Featurizer`.
+    scorer:
+        Function which scores the contents of the revisions like
+        :func:`score_revisions`, e.g. the method of a
+        :class:`wikidit.service.ServiceClient`. If given, ``model``,
+        ``n_jobs``, and ``word_counter`` are not used.
+
+    Returns
+    --------
+    list
+        For each title, a dict with the page title, revision id, the
+        assessed quality (``quality``), the predicted class (``best``), the
+        expected quality (``score``), and the probability of each class
+        (``prob``). Missing pages only have ``title`` and ``missing``.
+
+    """
+    return score_page_revisions(
+        titles,
+        get_pages(titles, session or default_session()),
+        model,
+        n_jobs=n_jobs,
+        word_counter=word_counter,
+        scorer=scorer,
+    )
+
+
+def score_page_revisions(
+    titles: List[str],
+    pages: Dict[str, Optional[Dict]],
+    model=None,
+    n_jobs: int = 1,
+    word_counter: str = "spacy",
+    scorer: Optional[Callable[[List[str]], pd.DataFrame]] = None,
+) -> List[Dict]:
+    """Predict the quality of pages which have already been retrieved.
+
+    This is :func:`score_titles` after the pages are retrieved, e.g. with
+    :func:`wikidit.mw.get_pages_async`. ``pages`` has the revision of each
+    of ``titles``, or ``None`` if it is missing. The other parameters and
+    the result are those of :func:`score_titles`.
+    """
+    if scorer is None:
+        if model is None:
+            model = get_model()
+
+        def scorer(contents):
+            return score_revisions(
+                contents, model, n_jobs=n_jobs, word_counter=word_counter
+            )
+
+    found = [title for title in titles if pages[title] is not None]
+    scores = scorer([pages[t]["content"] for t in found])
+    results = {}
+    for title, (_, row) in zip(found, scores.iterrows()):
+        page = pages[title]
+        results[title] = {
+            "title": page["title"],
+            "revid": page["revid"],
+            "quality": page["quality"],
+            "best": row["best"],
+            "score": float(row["score"]),
+            "prob": {k: float(row[f"prob_{k}"]) for k in WP10_LABELS},
+        }
+    return [results.get(t, {"title": t, "missing": True}) for t in titles]
+
+
+def model_version(path: Optional[str] = None) -> str:
+    """Return a hash of the model which :func:`load_model` loads from ``path``.
+
+    For a directory, as written by :func:`wikidit.compiled.export_model`,
+    the hash covers the names and contents of all its files.
+    """
+    if path is None:
+        path = os.environ.get("WIKIDIT_MODEL", _MODEL_PATH)
+    if os.path.isdir(path):
+        filenames = sorted(
+            os.path.relpath(os.path.join(root, f), path)
+            for root, _, files in os.walk(path)
+            for f in files
+        )
+    else:
+        filenames = [os.path.basename(path)]
+        path = os.path.dirname(path)
+    digest = hashlib.sha1()
+    for name in filenames:
+        digest.update(name.encode("utf-8"))
+        with open(os.path.join(path, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_model(path: Optional[str] = None):
+    """Load the trained quality prediction model.
+
+    ``path`` defaults to the ``WIKIDIT_MODEL`` environment variable, or the
+    pickled model in the package. If ``path`` is a directory, it is loaded
+    as a model exported by :func:`wikidit.compiled.export_model`, which
+    is not unpickled and does not need dill.
+    """
+    if path is None:
+        path = os.environ.get("WIKIDIT_MODEL", _MODEL_PATH)
+    if os.path.isdir(path):
+        from .compiled import CompiledModel
+
+        return CompiledModel.load(path)
+    import dill
+
+    with open(path, 'rb') as f:
         model = dill.load(f)
     return model
+
+
+@lazy
+def get_model():
+    """Return the trained quality prediction model, loading it on first use."""
+    return load_model()
+
+
+@lazy
+def get_model_version():
+    """Return the hash of the model returned by :func:`get_model`."""
+    return model_version()
@@ -1,20 +1,87 @@
+import asyncio
+import bz2
 import itertools
+import logging
 import re
+import time
 from collections import Counter
-from typing import Generator, Optional, Dict
+from functools import lru_cache
+from typing import Generator, Iterable, List, Optional, Dict
 
-from mwxml import Dump, Revision
+from mwxml import Dump, Page, Revision
 import mwapi
+import mwtypes.files
 from mwparserfromhell.wikicode import Wikicode, Template
 
+from . import metrics
+from .utils import lazy, split_seq
+
+logger = logging.getLogger(__name__)
+
 
 class Session(mwapi.Session):
 
     _HOSTNAME = "https://en.wikipedia.org"
     _USER_AGENT = "wikidit <jeffrey.arnold@gmail.com>"
 
-    def __init__(self):
-        super().__init__(self._HOSTNAME, user_agent=self._USER_AGENT)
+    def __init__(self, host: str = _HOSTNAME):
+        super().__init__(host, user_agent=self._USER_AGENT)
+
+
+@lazy
+def default_session() -> Session:
+    """Return the session used when none is given, created on first use."""
+    return Session()
+
+
+RETRY_CODES = ("maxlag", "ratelimited", "readonly")
+"""API error codes for which requests are retried."""
+
+_RETRY_ERRORS = (
+    mwapi.errors.ConnectionError,
+    mwapi.errors.TimeoutError,
+    mwapi.errors.HTTPError,
+    mwapi.errors.RequestError,
+    # responses which are not JSON, e.g. error pages from a proxy
+    ValueError,
+)
+
+
+def get_with_retries(
+    session: Session, retries: int = 5, backoff: float = 1.0, **params
+) -> Dict:
+    """Make an API request, retrying failed requests with exponential backoff.
+
+    Requests are retried after connection errors, timeouts, invalid
+    responses, and API errors asking clients to slow down, e.g. when the
+    replication lag is above the ``maxlag`` parameter.
+
+    Parameters
+    -----------
+    session:
+        The API session.
+    retries:
+        Maximum number of times to retry a request.
+    backoff:
+        Seconds to wait before the first retry. This doubles for each retry.
+    params:
+        Parameters of the request.
+
+    """
+    for attempt in itertools.count():
+        try:
+            return session.get(**params)
+        except mwapi.errors.APIError as e:
+            if e.code not in RETRY_CODES or attempt >= retries:
+                raise
+            error = e
+        except _RETRY_ERRORS as e:
+            if attempt >= retries:
+                raise
+            error = e
+        delay = backoff * 2 ** attempt
+        logger.warning(f"Retrying request in {delay:.1f}s after error: {error}")
+        time.sleep(delay)
 
 
 def iter_revisions(
@@ -58,6 +125,61 @@ def revision_to_dict(rev: Revision) -> Dict:
     return rev
 
 
+def open_dump(path: str) -> Dump:
+    """Open a (possibly compressed) XML dump file."""
+    return Dump.from_file(mwtypes.files.reader(path))
+
+
+def read_multistream_index(filename: str) -> List[int]:
+    """Read the offsets of the streams of a multistream dump.
+
+    The index of a ``pages-articles-multistream`` dump has a line
+    ``offset:page_id:title`` for each page, where ``offset`` is the byte
+    offset of the bz2 stream with the page in the dump file. Each stream
+    holds about 100 pages.
+    """
+    offsets = set()
+    with mwtypes.files.reader(filename) as f:
+        for line in f:
+            offsets.add(int(line.split(":", 1)[0]))
+    return sorted(offsets)
+
+
+def _read_stream(file, offset: int, bufsize: int = 2 ** 16) -> str:
+    """Decompress the bz2 stream starting at ``offset`` in ``file``."""
+    file.seek(offset)
+    decompressor = bz2.BZ2Decompressor()
+    data = []
+    while not decompressor.eof:
+        chunk = file.read(bufsize)
+        if not chunk:
+            break
+        data.append(decompressor.decompress(chunk))
+    return b"".join(data).decode("utf-8")
+
+
+def iter_multistream_pages(
+    filename: str, offsets: Iterable[int]
+) -> Generator[Page, None, None]:
+    """Iterate over the pages in some streams of a multistream dump.
+
+    Only one stream is decompressed at a time, so different processes can
+    read different streams of the same dump.
+
+    Parameters
+    -----------
+    filename:
+        The ``pages-articles-multistream.xml.bz2`` dump file.
+    offsets:
+        Byte offsets of the streams to read, e.g. from
+        :func:`read_multistream_index`.
+
+    """
+    with open(filename, "rb") as f:
+        for offset in offsets:
+            yield from Dump.from_page_xml(_read_stream(f, offset))
+
+
 def template_counts(wikicode: Wikicode) -> Counter:
     """Count unique templates in a wikicode object"""
     return Counter(str(x.name).strip() for x in wikicode.ifilter_templates())
@@ -75,70 +197,403 @@ def num_headings(text: str, level: int) -> int:
 
 def clean_template_name(x: Template) -> str:
     """Return the cleaned and standardized template name"""
-    return str(x.name).strip().lower().replace(" ", "_").replace("-", "_")
+    return _clean_name(str(x.name))
+
+
+def _clean_name(name: str) -> str:
+    return name.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+@lru_cache(maxsize=None)
+def _compile(pattern: str):
+    return re.compile(pattern, re.I)
 
 
 def match_template(x: Template, pattern: str) -> bool:
     """Does the object match ``pattern``"""
-    return bool(re.match(pattern, clean_template_name(x), re.I))
+    return match_template_name(clean_template_name(x), pattern)
+
+
+def match_template_name(name: str, pattern: str) -> bool:
+    """Does the cleaned template name match ``pattern``"""
+    return bool(_compile(pattern).match(name))
 
 
 def wikilink_title_matches(pattern: str, link: str) -> bool:
     """Does wikilink title match ``pattern``"""
-    return bool(re.match(pattern, str(link.title), re.I))
+    return bool(_compile(pattern).match(str(link.title)))
 
 
-def get_page(title: str, session: Session=Session()):
-    if title is None or title == "":
-        return None
-    params = {
-        "action": "query",
-        "titles": title,
-        "prop": "revisions",
+TEMPLATE_PATTERNS = {
+    "main_templates": "main$",
+    "cite_templates": "cite",
+    "infoboxes": "infobox",
+}
+"""Patterns matched against cleaned template names for each feature."""
+
+
+WIKILINK_PATTERNS = {"images": r"file|image\:", "categories": r"category\:"}
+"""Patterns matched against wikilink titles for each feature."""
+
+
+def _compile_alternation(patterns: Dict[str, str]):
+    """Combine mutually exclusive patterns into one named alternation."""
+    return _compile("|".join(f"(?P<{k}>{v})" for k, v in patterns.items()))
+
+
+_TEMPLATE_RE = _compile_alternation(TEMPLATE_PATTERNS)
+_WIKILINK_RE = _compile_alternation(WIKILINK_PATTERNS)
+
+
+@lru_cache(maxsize=2 ** 16)
+def classify_template_name(name: str) -> Optional[str]:
+    """Return the feature in ``TEMPLATE_PATTERNS`` matching a raw template name.
+
+    Names are cleaned as in :func:`clean_template_name`.
+    """
+    m = _TEMPLATE_RE.match(_clean_name(name))
+    return m.lastgroup if m else None
+
+
+@lru_cache(maxsize=2 ** 16)
+def classify_wikilink_title(title: str) -> Optional[str]:
+    """Return the feature in ``WIKILINK_PATTERNS`` matching a wikilink title."""
+    m = _WIKILINK_RE.match(title)
+    return m.lastgroup if m else None
+
+
+def _resolve_title(query: Dict, title: str) -> str:
+    """Apply the title normalizations and redirects in a query response."""
+    for key in ("normalized", "redirects"):
+        for x in query.get(key, []):
+            if x["from"] == title:
+                title = x["to"]
+    return title
+
+
+def _merge_pages(responses: Iterable[Dict], titles: str) -> Dict:
+    """Merge the pages of (continued) query responses by requested title."""
+    pages = {}
+    query = {}
+    for r in responses:
+        for key in ("normalized", "redirects"):
+            query.setdefault(key, []).extend(r["query"].get(key, []))
+        for page in r["query"]["pages"].values():
+            merged = pages.setdefault(page["title"], {})
+            for k, v in page.items():
+                if isinstance(v, list):
+                    merged.setdefault(k, []).extend(v)
+                elif isinstance(v, dict):
+                    merged.setdefault(k, {}).update(v)
+                else:
+                    merged[k] = v
+    return {t: pages.get(_resolve_title(query, t)) for t in titles.split("|")}
+
+
+def query_pages(session: Session, **params) -> Dict:
+    """Query pages, following continuations, and return pages by title.
+
+    Parameters
+    -----------
+    session:
+        The API session.
+    params:
+        Parameters of an ``action=query`` request.
+
+    Returns
+    --------
+    dict:
+        Pages keyed by the requested titles. Titles are resolved through
+        normalizations and redirects, and the revisions and categories of
+        continued responses are merged.
+
+    """
+    metrics.increment("wikidit_upstream_requests_total")
+    try:
+        responses = session.get(action="query", continuation=True, **params)
+        return _merge_pages(responses, params["titles"])
+    except Exception as e:
+        metrics.increment("wikidit_upstream_errors_total", error=type(e).__name__)
+        raise
+
+
+def valid_title(title: Optional[str]) -> bool:
+    """Can ``title`` be requested from the API?
+
+    Titles cannot be empty or contain ``|``, which separates the titles of
+    a request.
+    """
+    return bool(title) and "|" not in title
+
+
+def _page_params(titles: List[str]) -> Dict:
+    """Query parameters for the content and assessments of pages."""
+    return {
+        "titles": "|".join(titles),
+        "prop": "revisions|pageassessments",
         "redirects": True,
         "rvprop": "ids|content|timestamp",
         "rvslots": "main",
+        "palimit": "max",
     }
-    r = session.get(**params)
-    page = list(r["query"]["pages"].values())[0]
+
+
+def _parse_page(pages: Dict, title: str) -> Optional[Dict]:
+    """Create the revision returned by :func:`get_page` from queried pages."""
+    page = pages[title]
     # There is no such page!
-    if "missing" in page:
+    if page is None or "missing" in page or "invalid" in page:
         return None
-    rev = page["revisions"][0]
-    rev["content"] = rev["slots"]["main"]["*"]
-    del rev["slots"]
+    # Copy, since several titles can redirect to the same page
+    rev = {k: v for k, v in page["revisions"][0].items() if k != "slots"}
+    rev["content"] = page["revisions"][0]["slots"]["main"]["*"]
     rev["title"] = page["title"]
     rev["pageid"] = page["pageid"]
     rev["talk_page"] = f"Talk:{rev['title']}"
-    rev["quality"] = get_quality(rev["talk_page"], session)
+    rev["quality"] = parse_assessments(page.get("pageassessments", {}))
     return rev
 
 
+def get_page(title: str, session: Session=Session()):
+    """Get the current revision of a page and its quality assessment.
+
+    The content of the page and its WikiProject assessments are retrieved in
+    a single request. The quality is the highest class of the assessments,
+    which are made by the project banners on the talk page, and put the talk
+    page in the categories read by :func:`get_quality`, so the talk page
+    itself is not requested.
+    """
+    if not valid_title(title):
+        return None
+    with metrics.timer("mw_page"):
+        return _parse_page(query_pages(session, **_page_params([title])), title)
+
+
+def get_pages(
+    titles: Iterable[str], session: Optional[Session] = None, chunksize: int = 50
+) -> Dict[str, Optional[Dict]]:
+    """Get the current revisions of many pages and their quality assessments.
+
+    Parameters
+    -----------
+    titles:
+        Titles of the pages.
+    session:
+        The API session. If ``None``, :func:`default_session` is used.
+    chunksize:
+        Number of pages per request. This should be at most 50, the API
+        limit of titles per request.
+
+    Returns
+    --------
+    dict:
+        The revision, as returned by :func:`get_page`, for each title.
+        Missing pages, and invalid titles, are ``None``.
+
+    """
+    if session is None:
+        session = default_session()
+    out = {}
+    for chunk in split_seq(titles, chunksize):
+        valid = [title for title in chunk if valid_title(title)]
+        pages = query_pages(session, **_page_params(valid)) if valid else {}
+        out.update(_parse_pages(pages, chunk))
+    return out
+
+
+def _parse_pages(pages: Dict, titles: List[str]) -> Dict[str, Optional[Dict]]:
+    return {t: _parse_page(pages, t) if t in pages else None for t in titles}
+
+
 def get_content(page: Dict) -> str:
     return page["revisions"][0]["slots"]["main"]["*"]
 
 
+_QUALITY_RE = re.compile(r"Category:(FA|G?A|B|C|Start|Stub)-Class")
+
+_QUALITY_CLASSES = {
+    "FA": "FA",
+    "GA": "GA",
+    "A": "GA",
+    "B": "B",
+    "C": "C",
+    "Start": "Start",
+    "Stub": "Stub",
+}
+"""Quality class for each category prefix. A-Class is treated as GA."""
+
+_QUALITY_ORDER = ("FA", "GA", "B", "C", "Start", "Stub")
+
+
+def _highest_quality(classes: Iterable[str]) -> Optional[str]:
+    found = {_QUALITY_CLASSES[x] for x in classes if x in _QUALITY_CLASSES}
+    for klass in _QUALITY_ORDER:
+        if klass in found:
+            return klass
+    return None
+
+
+def parse_quality(categories: Iterable[Dict]) -> Optional[str]:
+    """Return the highest WP10 quality class in talk page categories."""
+    matches = (_QUALITY_RE.match(x["title"]) for x in categories)
+    return _highest_quality(m.group(1) for m in matches if m)
+
+
+def parse_assessments(assessments: Dict[str, Dict]) -> Optional[str]:
+    """Return the highest WP10 quality class in the assessments of a page.
+
+    ``assessments`` are the ``pageassessments`` of a page in a query
+    response, the class and importance given by each WikiProject.
+    """
+    return _highest_quality(x.get("class") for x in assessments.values())
+
+
 def get_quality(title: str, session: Session=Session()) -> Optional[str]:
     # norm_title = normalize_title(title, session=session)
-    result = session.get(action="query", titles=title, prop="categories")
-    categories = list(result["query"]["pages"].values())[0]["categories"]
-    patterns = [
-        ("FA", "FA"),
-        ("G?A", "GA"),
-        ("B", "B"),
-        ("C", "C"),
-        ("Start", "Start"),
-        ("Stub", "Stub"),
-    ]
-    qa = None
-    for pat, klass in patterns:
-        if len(
-            [
-                x["title"]
-                for x in categories
-                if re.match("Category:{}-Class".format(pat), x["title"])
-            ]
-        ):
-            qa = klass
-            break
-    return qa
+    with metrics.timer("mw_quality"):
+        pages = query_pages(session, titles=title, prop="categories", cllimit="max")
+    page = pages[title]
+    if page is None:
+        return None
+    return parse_quality(page.get("categories", []))
+
+
+class AsyncSession:
+    """Asynchronous session for the MediaWiki API.
+
+    Requests share a pool of at most ``limit`` connections. This requires
+    `aiohttp <https://aiohttp.readthedocs.io>`_, which is imported when the
+    session is created.
+
+    Parameters
+    -----------
+    host:
+        Host of the MediaWiki API.
+    limit:
+        Maximum number of simultaneous connections.
+    timeout:
+        Timeout of each request in seconds.
+
+    """
+
+    _HOSTNAME = Session._HOSTNAME
+    _USER_AGENT = Session._USER_AGENT
+
+    def __init__(
+        self, host: str = _HOSTNAME, limit: int = 20, timeout: float = 30
+    ) -> None:
+        import aiohttp
+
+        self._aiohttp = aiohttp
+        self.api_url = f"{host}/w/api.php"
+        self.limit = limit
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        # The client is created in the event loop that first uses it
+        if self._client is None or self._client.closed:
+            self._client = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(limit=self.limit),
+                timeout=self._aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": self._USER_AGENT},
+            )
+        return self._client
+
+    async def _request(self, params: Dict) -> Dict:
+        async with self._get_client().get(self.api_url, params=params) as resp:
+            doc = await resp.json(content_type=None)
+        if "error" in doc:
+            raise mwapi.errors.APIError.from_doc(doc["error"])
+        return doc
+
+    async def get(self, continuation: bool = False, **params):
+        """Make an API request with the GET method.
+
+        Parameters are converted as in :meth:`mwapi.Session.get`. If
+        ``continuation`` is true, continuations are followed and a list of
+        all the response documents is returned.
+        """
+        params = {k: _normalize_param(v) for k, v in params.items()}
+        params = {k: v for k, v in params.items() if v is not None}
+        params["format"] = "json"
+        if not continuation:
+            return await self._request(params)
+        params["continue"] = ""
+        docs = []
+        while True:
+            doc = await self._request(params)
+            docs.append(doc)
+            if "continue" not in doc:
+                return docs
+            params.update(doc["continue"])
+
+    async def close(self) -> None:
+        """Close the connection pool."""
+        if self._client is not None:
+            await self._client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+def _normalize_param(value):
+    if isinstance(value, bool):
+        return "" if value else None
+    return str(value)
+
+
+async def query_pages_async(session: AsyncSession, **params) -> Dict:
+    """Asynchronous version of :func:`query_pages`."""
+    metrics.increment("wikidit_upstream_requests_total")
+    try:
+        responses = await session.get(action="query", continuation=True, **params)
+        return _merge_pages(responses, params["titles"])
+    except Exception as e:
+        metrics.increment("wikidit_upstream_errors_total", error=type(e).__name__)
+        raise
+
+
+async def get_page_async(title: str, session: AsyncSession) -> Optional[Dict]:
+    """Asynchronous version of :func:`get_page`."""
+    if not valid_title(title):
+        return None
+    with metrics.timer("mw_page"):
+        pages = await query_pages_async(session, **_page_params([title]))
+    return _parse_page(pages, title)
+
+
+async def get_quality_async(title: str, session: AsyncSession) -> Optional[str]:
+    """Asynchronous version of :func:`get_quality`."""
+    with metrics.timer("mw_quality"):
+        pages = await query_pages_async(
+            session, titles=title, prop="categories", cllimit="max"
+        )
+    if pages[title] is None:
+        return None
+    return parse_quality(pages[title].get("categories", []))
+
+
+async def get_pages_async(
+    titles: Iterable[str], session: AsyncSession, chunksize: int = 50
+) -> Dict[str, Optional[Dict]]:
+    """Asynchronous version of :func:`get_pages`.
+
+    The chunks of titles are requested concurrently.
+    """
+
+    async def get_chunk(chunk):
+        valid = [title for title in chunk if valid_title(title)]
+        if not valid:
+            return {}
+        return await query_pages_async(session, **_page_params(valid))
+
+    chunks = list(split_seq(titles, chunksize))
+    responses = await asyncio.gather(*(get_chunk(chunk) for chunk in chunks))
+    out = {}
+    for chunk, pages in zip(chunks, responses):
+        out.update(_parse_pages(pages, chunk))
+    return out
@@ -1,68 +1,196 @@
 from sklearn.base import ClassifierMixin
 from sklearn.base import TransformerMixin
 from sklearn.base import clone
-from sklearn.utils import Parallel, delayed
 from sklearn.utils.validation import has_fit_parameter, check_is_fitted
 from sklearn.utils.metaestimators import _BaseComposition
 from sklearn.utils import Bunch
 
 import numpy as np
 import pandas as pd
+from joblib import Parallel, cpu_count, delayed, effective_n_jobs
+
+
+def combine_log_probas(log_probas):
+    """Combine the log probabilities of the stages of a sequential model.
+
+    The log probability of class ``k`` is the sum of the log probabilities
+    of passing stages ``0, ..., k - 1`` and of stopping at stage ``k``, so
+    all classes are computed with one cumulative sum.
+
+    Parameters
+    -----------
+    log_probas:
+        For each stage, an array with the log probabilities of stopping at
+        and passing the stage, with one row per observation.
+
+    Returns
+    --------
+    np.ndarray
+        The log probabilities of the classes, with one row per observation.
+
+    """
+    # stages x rows x (stop, pass)
+    logp = np.stack(log_probas)
+    out = np.zeros((logp.shape[0] + 1, logp.shape[1]))
+    np.cumsum(logp[:, :, 1], axis=0, dtype=out.dtype, out=out[1:])
+    out[:-1] += logp[:, :, 0]
+    return out.T
 
 
 def _parallel_fit_estimator(estimator, X, y, cat):
-    touse = y >= cat
-    y_transform = y > cat
-    return estimator.fit(X[touse, :], y_transform[touse])
+    # Only the rows used by this stage are copied from the shared X
+    rows = np.flatnonzero(y >= cat)
+    return estimator.fit(X[rows], y[rows] > cat)
 
 
 class SequentialClassifier(_BaseComposition, ClassifierMixin, TransformerMixin):
-    def __init__(self, estimator, n_jobs=None, proba_transform=None):
+    """Sequential (continuation ratio) model for ordered classes.
+
+    Stage ``k`` is a binary classifier for whether the class is larger than
+    ``k``, fit to the observations with class at least ``k``.
+
+    Parameters
+    -----------
+    estimator:
+        The binary classifier used for each stage.
+    n_jobs:
+        Number of stages fit in parallel.
+    proba_transform:
+        If true, ``transform`` returns class probabilities rather than
+        classes.
+    estimator_n_jobs:
+        Number of threads used by each stage estimator, if it has an
+        ``n_jobs`` parameter. If ``None`` and stages are fit in parallel, the
+        CPUs are divided between the stages so that parallel stages and the
+        threads of e.g. XGBoost do not oversubscribe the CPUs.
+    predict_n_jobs:
+        Number of threads in which the stages are evaluated in parallel when
+        predicting. If ``None``, they are evaluated one after another, which
+        is faster for small batches, e.g. the rows of a single page.
+
+    """
+
+    def __init__(
+        self,
+        estimator,
+        n_jobs=None,
+        proba_transform=None,
+        estimator_n_jobs=None,
+        predict_n_jobs=None,
+    ):
         self.estimator = estimator
         self.n_jobs = n_jobs
         self.proba_transform = proba_transform
+        self.estimator_n_jobs = estimator_n_jobs
+        self.predict_n_jobs = predict_n_jobs
+
+    def __setstate__(self, state):
+        # Models pickled before these parameters were added
+        state.setdefault("estimator_n_jobs", None)
+        state.setdefault("predict_n_jobs", None)
+        super().__setstate__(state)
 
     def fit(self, X, y, categories="auto"):
+        """Fit the stage estimators.
+
+        ``X`` is converted to an array once. When stages are fit in parallel
+        processes, joblib memory-maps the array, so all workers share one
+        copy of it, and each stage only copies the rows it uses. The column
+        names of a data frame are kept in ``feature_names_in_``, and data
+        frames are converted to arrays with these columns when predicting.
+        """
         # this is hard-coded for categorical variables
         if isinstance(y, pd.Series) and hasattr(y, "cat"):
             y = y.cat.codes
+        if hasattr(X, "columns"):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        elif hasattr(self, "feature_names_in_"):
+            del self.feature_names_in_
+        X = np.asarray(X)
+        y = np.asarray(y)
 
         self.n_classes_ = np.max(y) + 1
         categories = list(range(self.n_classes_))
 
+        n_workers = min(effective_n_jobs(self.n_jobs), len(categories) - 1)
+        estimator = clone(self.estimator)
+        n_threads = self.estimator_n_jobs
+        if n_threads is None and n_workers > 1:
+            n_threads = max(1, cpu_count() // n_workers)
+        if n_threads is not None and "n_jobs" in estimator.get_params():
+            estimator.set_params(n_jobs=n_threads)
+
         # order of estimators
-        self.estimators_ = Parallel(n_jobs=self.n_jobs)(
-            delayed(_parallel_fit_estimator)(clone(self.estimator), X, y, cat)
+        self.estimators_ = Parallel(n_jobs=n_workers, mmap_mode="r")(
+            delayed(_parallel_fit_estimator)(clone(estimator), X, y, cat)
             for cat in categories[:-1]
         )
         return self
 
-    def predict(self, X):
+    def _to_array(self, X):
+        """Convert ``X`` to an array like the one the stages were fit on."""
+        # Models fit on arrays, or pickled before feature_names_in_ was
+        # added, use the columns of a data frame in order.
+        names = getattr(self, "feature_names_in_", None)
+        if names is not None and hasattr(X, "columns"):
+            X = X[list(names)]
+        return np.asarray(X)
+
+    def predict(self, X, early_exit=False):
+        """Predict the median class.
+
+        If ``early_exit`` is true, each row is only passed to the stage
+        estimators until its median class is known, i.e. until the
+        probability of a higher class is at most 0.5. This is faster when
+        many rows are in the lower classes.
+        """
+        if early_exit:
+            return self._predict_early_exit(X)
         # For prediction use the median class, not the modal class
         cdf = np.cumsum(self.predict_proba(X), axis=1)
         out = np.argmax(cdf >= 0.5, axis=1)
         return out
 
-    def _collect_log_probas(self, X):
-        """Collect results from predict calls. """
+    def _predict_early_exit(self, X):
+        X = self._to_array(X)
+        out = np.full(X.shape[0], self.n_classes_ - 1)
+        rows = np.arange(X.shape[0])
+        # log probability that the class is higher than the current stage
+        log_survival = np.zeros(X.shape[0])
+        for i, clf in enumerate(self.estimators_):
+            if not len(rows):
+                break
+            log_survival += self._stage_log_proba(clf, X[rows])[:, 1]
+            done = log_survival <= np.log(0.5)
+            out[rows[done]] = i
+            rows = rows[~done]
+            log_survival = log_survival[~done]
+        return out
+
+    def _stage_log_proba(self, clf, X):
         # If it has log_proba available, use it since we will be multiplying
         # by probabilities.
-        if hasattr(self.estimator, "predict_log_proba"):
-            return [clf.predict_log_proba(X) for clf in self.estimators_]
+        if hasattr(clf, "predict_log_proba"):
+            return clf.predict_log_proba(X)
         else:
-            return [np.log(clf.predict_proba(X)) for clf in self.estimators_]
+            return np.log(clf.predict_proba(X))
+
+    def _collect_log_probas(self, X):
+        """Collect results from predict calls.
+
+        If ``predict_n_jobs`` is set, the stages are evaluated in parallel
+        threads.
+        """
+        X = self._to_array(X)
+        if self.predict_n_jobs in (None, 1):
+            return [self._stage_log_proba(clf, X) for clf in self.estimators_]
+        return Parallel(n_jobs=self.predict_n_jobs, prefer="threads")(
+            delayed(self._stage_log_proba)(clf, X) for clf in self.estimators_
+        )
 
     def _predict_log_proba(self, X):
         """Predict log class probabilities for X"""
-        out = np.zeros((X.shape[0], self.n_classes_))
-        for i, logp in enumerate(self._collect_log_probas(X)):
-            out[:, i] += logp[:, 0]
-            for j in range(i + 1, self.n_classes_):
-                out[:, j] += logp[:, 1]
-            # add log conditional probability
-            # logp += out[:, (i, )]
-            # out[:, i:(i + 2)] = logp
-        return out
+        return combine_log_probas(self._collect_log_probas(X))
 
     @property
     def predict_log_proba(self):
@@ -1,20 +1,34 @@
 """Functions related to preprocessing revisions."""
+import hashlib
 import json
 import os.path
+import re
+import time
 from collections import Counter
-from typing import Dict
+from functools import lru_cache
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
 
 import mwparserfromhell as mwparser
 import pandas as pd
-from spacy.lang.en import English
+from mwparserfromhell.nodes import ExternalLink, Heading, Tag, Template, Wikilink
 # import en_core_web_md
 
-from .mw import match_template, wikilink_title_matches
+from . import metrics
+from .mw import classify_template_name, classify_wikilink_title
+from .utils import lazy
 
-# NLP = en_core_web_md.load(disable=["ner", "parser"])
-# We're only using the tokenizer at the moment. However, leave it open to use
-# word vectors.
-NLP = English()
+
+@lazy
+def get_nlp():
+    """Return the spaCy pipeline, loading it on first use."""
+    # spaCy is imported here since it is slow to import and not needed when
+    # words are counted with a regex.
+    from spacy.lang.en import English
+
+    # NLP = en_core_web_md.load(disable=["ner", "parser"])
+    # We're only using the tokenizer at the moment. However, leave it open to use
+    # word vectors.
+    return English()
 
 
 # Backlog data
@@ -24,10 +38,14 @@ def _load_backlog() -> Dict:
         return json.load(f)
 
 
-backlog_templates: Dict = _load_backlog()
+@lazy
+def get_backlog_templates() -> Dict:
+    """Return the backlog templates, loading them on first use."""
+    return _load_backlog()
 
 
 def _backlog_featurizer() -> Dict:
+    backlog_templates = get_backlog_templates()
     backlog_issues = {}
     exclude = ("Too few wikilinks",)
     sections = (
@@ -55,21 +73,261 @@ def _backlog_featurizer() -> Dict:
     return backlog_issues
 
 
-backlog_features: Dict = _backlog_featurizer()
+@lazy
+def get_backlog_table() -> Dict:
+    """Return a mapping of lower-cased backlog template names to sections."""
+    return _backlog_featurizer()
+
+
+_LAZY_ATTRS = {
+    "NLP": get_nlp,
+    "backlog_templates": get_backlog_templates,
+    "backlog_features": get_backlog_table,
+}
+
+
+def __getattr__(name):
+    # Module attributes that used to be loaded at import time
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_backlog_features(doc) -> Dict:
     """Get backlog features from templates."""
-    template_counts = Counter(
-        [str(x.name).strip().lower() for x in doc.filter_templates()]
+    return count_backlog_issues(
+        str(x.name).strip().lower() for x in doc.filter_templates()
     )
-    features = {k: {} for k in set(backlog_features.values())}
-    for name, count in template_counts.items():
-        if name.lower() in backlog_features:
-            features[backlog_features[name]][name] = count
+
+
+def count_backlog_issues(names: Iterable[str]) -> Dict:
+    """Count backlog issues from lower-cased template names."""
+    backlog_features = get_backlog_table()
+    features = {k: Counter() for k in set(backlog_features.values())}
+    for name in names:
+        section = backlog_features.get(name)
+        if section is not None:
+            features[section][name] += 1
     return features
 
 
+BACKLOG_SECTIONS = {
+    "Accuracy": "backlog_accuracy",
+    "Content": "backlog_content",
+    "Style": "backlog_style",
+    "File": "backlog_files",
+    "Other": "backlog_other",
+    "Links": "backlog_links",
+}
+"""Names of the revision features for each backlog section."""
+
+
+_COORDINATES_RE = re.compile(r"#coordinates", re.I)
+
+
+@lru_cache(maxsize=2 ** 16)
+def classify_template(name: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """Classify a raw template name.
+
+    Parameters
+    -----------
+    name: str
+        The template name as it appears in the wikitext.
+
+    Returns
+    --------
+    tuple:
+        The stripped and lower-cased name, its feature in
+        ``mw.TEMPLATE_PATTERNS`` (or ``None``), and its backlog section
+        (or ``None``).
+
+    """
+    lower_name = name.strip().lower()
+    return (
+        lower_name,
+        classify_template_name(name),
+        get_backlog_table().get(lower_name),
+    )
+
+
+def _walk_nodes(text) -> Tuple[Counter, Dict[str, Counter]]:
+    """Count nodes of each type and backlog templates in one walk."""
+    counts = Counter()
+    backlog_issues = {k: Counter() for k in set(get_backlog_table().values())}
+    for node in text.ifilter(recursive=True):
+        if isinstance(node, Template):
+            counts["templates"] += 1
+            name, feature, backlog = classify_template(str(node.name))
+            if feature is not None:
+                counts[feature] += 1
+            if backlog is not None:
+                backlog_issues[backlog][name] += 1
+        elif isinstance(node, Wikilink):
+            counts["wikilinks"] += 1
+            feature = classify_wikilink_title(str(node.title))
+            if feature is not None:
+                counts[feature] += 1
+        elif isinstance(node, Heading):
+            if node.level == 2:
+                counts["headings"] += 1
+            elif node.level > 2:
+                counts["sub_headings"] += 1
+        elif isinstance(node, ExternalLink):
+            counts["external_links"] += 1
+        elif isinstance(node, Tag):
+            if node.tag == "ref":
+                counts["ref"] += 1
+    return counts, backlog_issues
+
+
+def _node_features(counts: Counter, backlog_issues: Dict[str, Counter]) -> Dict:
+    revision = {
+        "headings": counts["headings"],
+        "sub_headings": counts["sub_headings"],
+        "images": counts["images"],
+        "categories": counts["categories"],
+        # Other wikilinks
+        "wikilinks": counts["wikilinks"] - counts["images"] - counts["categories"],
+        "external_links": counts["external_links"],
+        "main_templates": counts["main_templates"],
+        "cite_templates": counts["cite_templates"],
+        "infoboxes": counts["infoboxes"],
+        "templates": counts["templates"],
+    }
+    for k, v in BACKLOG_SECTIONS.items():
+        if len(backlog_issues[k]):
+            revision[v] = sum(backlog_issues[k].values())
+            revision[f"{v}_templates"] = " ".join(backlog_issues[k].keys())
+        else:
+            revision[v] = 0
+            revision[f"{v}_templates"] = None
+    revision["ref"] = counts["ref"]
+    return revision
+
+
+def count_nodes(text) -> Dict:
+    """Count features of the nodes of a parsed revision.
+
+    All counts are collected in a single walk over the node tree, rather than
+    one walk per node type. Each template and wikilink is classified with a
+    single lookup in the precompiled tables.
+
+    Parameters
+    -----------
+    text: Wikicode
+        The parsed revision.
+
+    Returns
+    --------
+    dict:
+        Counts of headings, links, templates, backlog issues, and ref tags.
+
+    """
+    return _node_features(*_walk_nodes(text))
+
+
+_HEADING_RE = re.compile(r"^=[^\n]*=[ \t]*$", re.M)
+
+
+def split_sections(content: str) -> List[str]:
+    """Split wikitext into sections at the heading lines.
+
+    Each section starts with its heading, except the lead section. The
+    sections concatenate to ``content``.
+    """
+    starts = [m.start() for m in _HEADING_RE.finditer(content) if m.start() > 0]
+    bounds = [0, *starts, len(content)]
+    return [content[i:j] for i, j in zip(bounds, bounds[1:])]
+
+
+_APPROX_TEMPLATE_RE = re.compile(r"(?<!\{)\{\{(?!\{)\s*([^{}|\n]*)")
+_APPROX_WIKILINK_RE = re.compile(r"\[\[\s*([^\[\]|\n]*)")
+_APPROX_HEADING_RE = re.compile(r"^(=+)[^\n]*?(=+)[ \t]*$", re.M)
+_APPROX_EXTERNAL_LINK_RE = re.compile(r"(?:\b(?:https?|ftps?)://|\[//)", re.I)
+_APPROX_REF_RE = re.compile(r"<ref[\s/>]", re.I)
+
+
+def count_nodes_regex(content: str) -> Dict:
+    """Approximate :func:`count_nodes` with regular expressions.
+
+    The wikitext is not parsed, so this takes time linear in the length of
+    ``content``. Templates, wikilinks, headings, external links, and ref tags
+    are counted from the markup which opens them, which also counts markup
+    in comments and ``<nowiki>`` tags.
+    """
+    counts = Counter()
+    backlog_issues = {k: Counter() for k in set(get_backlog_table().values())}
+    for name in _APPROX_TEMPLATE_RE.findall(content):
+        counts["templates"] += 1
+        name, feature, backlog = classify_template(name)
+        if feature is not None:
+            counts[feature] += 1
+        if backlog is not None:
+            backlog_issues[backlog][name] += 1
+    for title in _APPROX_WIKILINK_RE.findall(content):
+        counts["wikilinks"] += 1
+        feature = classify_wikilink_title(title)
+        if feature is not None:
+            counts[feature] += 1
+    for start, end in _APPROX_HEADING_RE.findall(content):
+        level = min(len(start), len(end), 6)
+        if level == 2:
+            counts["headings"] += 1
+        elif level > 2:
+            counts["sub_headings"] += 1
+    counts["external_links"] = len(_APPROX_EXTERNAL_LINK_RE.findall(content))
+    counts["ref"] = len(_APPROX_REF_RE.findall(content))
+    return _node_features(counts, backlog_issues)
+
+
+_STRIP_RES = (
+    (re.compile(r"<!--.*?(?:-->|$)", re.S), ""),
+    # Stops at the next ref tag, so unclosed tags cannot make this quadratic
+    (
+        re.compile(r"<ref[^>]*/>|<ref[^>]*>[^<]*(?:<(?!/?ref\b)[^<]*)*</ref\s*>", re.I),
+        "",
+    ),
+    (re.compile(r"<[^<>\n]*>"), ""),
+    (re.compile(r"\[\[[^\[\]|]*\|([^\[\]]*)\]\]"), r"\1"),
+    (re.compile(r"\[\[([^\[\]]*)\]\]"), r"\1"),
+    (
+        re.compile(r"\[(?:(?:https?|ftps?):)?//[^\s\]]*\s*([^\[\]\n]*)\]", re.I),
+        r"\1",
+    ),
+    (re.compile(r"'{2,}"), ""),
+    (re.compile(r"^=+|=+[ \t]*$", re.M), ""),
+    # Long runs of non-space characters are left over markup, or URLs, and
+    # are very slow to tokenize, so they are counted as a single word.
+    (re.compile(r"\S{100,}"), "x"),
+)
+_INNER_TEMPLATE_RE = re.compile(r"\{\{[^{}]*\}\}")
+_TEMPLATE_MARKUP_RE = re.compile(r"\{\{[^{}]*|\}\}")
+
+APPROX_MAX_DEPTH = 8
+"""Depth of nested templates removed by :func:`strip_markup`."""
+
+
+def strip_markup(content: str, max_depth: int = APPROX_MAX_DEPTH) -> str:
+    """Approximate ``strip_code`` of the parsed wikitext with regular expressions.
+
+    Templates are removed from the innermost out, for at most ``max_depth``
+    levels of nesting, so that deeply nested templates cannot make this
+    slow. The markup of any templates nested more deeply is then removed
+    with the text between it. Comments, ref tags, and other HTML tags are
+    removed, links are replaced by their text, and runs of 100 or more
+    non-space characters by a single word.
+    """
+    for _ in range(max_depth):
+        content, n = _INNER_TEMPLATE_RE.subn("", content)
+        if not n:
+            break
+    else:
+        content = _TEMPLATE_MARKUP_RE.sub("", content)
+    for regex, repl in _STRIP_RES:
+        content = regex.sub(repl, content)
+    return content
+
+
 WP10_LABELS: str = ("Stub", "Start", "C", "B", "GA", "FA")
 """Wikipeda WP10 Quality labels"""
 
@@ -82,14 +340,112 @@ def is_word(token) -> bool:
     return not (token.is_space or token.is_punct)
 
 
+# Possessives and contractions, e.g. "John's" and "don't", are split into two
+# tokens by spaCy, so their endings are matched as separate words.
+_CLITICS = r"(?:s|m|d|t|re|ve|ll)\b"
+_WORD_RE = re.compile(
+    rf"\w+(?:[.,]\w+|['’](?!{_CLITICS})\w+)*|['’]{_CLITICS}", re.I
+)
+
+
+def count_words_regex(text: str) -> int:
+    """Count words in ``text`` with a regular expression.
+
+    This approximates the number of non-space, non-punctuation tokens found
+    by the spaCy tokenizer without building a spaCy ``Doc``. Possessives and
+    contractions count as two words, as spaCy splits them. On the sample
+    article in ``tests/data`` the counts differ by 0.1%, and the tests
+    check that they are within 1%. Text with many symbols, e.g. currency
+    signs, which spaCy counts as words, can differ more.
+    """
+    return len(_WORD_RE.findall(text))
+
+
+WORD_COUNTERS = ("spacy", "regex")
+"""Methods available to count words in :class:`Featurizer`."""
+
+_FEATURIZER_SOURCES = ("preprocessing.py", "mw.py", "backlog.json")
+
+
+@lazy
+def get_source_version() -> str:
+    """Return a hash of the code and data used to create features."""
+    digest = hashlib.sha1()
+    for name in _FEATURIZER_SOURCES:
+        with open(os.path.join(os.path.dirname(__file__), name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+APPROX_SAMPLE_CHARS = 50000
+"""Characters of plain text tokenized to approximate the number of words."""
+
+_APPROX_SAMPLES = 10
+
+
 class Featurizer:
-    """Add common features to a revision."""
+    """Add common features to a revision.
+
+    Very large revisions can be featurized approximately, see
+    :meth:`approximate_content`, to bound the time spent on them.
+
+    Parameters
+    -----------
+    word_counter:
+        Method used to count words. ``"spacy"`` counts the non-space,
+        non-punctuation tokens from the spaCy tokenizer. ``"regex"`` uses
+        the much faster approximation in :func:`count_words_regex`.
+    max_bytes:
+        Revisions with more than this many bytes of UTF-8 content are
+        featurized approximately. If ``None``, there is no limit.
+    time_budget:
+        Seconds after which the remaining stages of :meth:`parse_content`
+        are skipped and the revision is featurized approximately. The budget
+        is only checked after parsing and after ``strip_code``, so it cannot
+        bound the time spent parsing, which is often most of the time spent
+        on a slow revision; use ``max_bytes`` for that. If ``None``, there is
+        no limit.
+
+    """
     # THis is implemented as a class rather than a function in order
-    nlp = NLP
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        word_counter: str = "spacy",
+        max_bytes: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> None:
+        if word_counter not in WORD_COUNTERS:
+            raise ValueError(
+                f"word_counter must be one of {WORD_COUNTERS}, got {word_counter!r}"
+            )
+        self.word_counter = word_counter
+        self.max_bytes = max_bytes
+        self.time_budget = time_budget
         self.parser = mwparser.parser.Parser()
 
+    @property
+    def nlp(self):
+        return get_nlp()
+
+    @property
+    def version(self) -> str:
+        """Version of the features created by this featurizer.
+
+        This changes whenever the featurizer code or options change, so it
+        can be used to invalidate cached features.
+        """
+        version = f"{get_source_version()}-{self.word_counter}"
+        if self.max_bytes is not None or self.time_budget is not None:
+            version += f"-approx{self.max_bytes}-{self.time_budget}"
+        return version
+
+    def count_words(self, text: str) -> int:
+        """Count the words in plain text."""
+        if self.word_counter == "regex":
+            return count_words_regex(text)
+        return len([tok for tok in self.nlp(text) if is_word(tok)])
+
     def featurize(self, x: Dict, content: str="content") -> Dict:
         x = x.copy()
         features = self.parse_content(x[content])
@@ -110,85 +466,35 @@ class Featurizer:
             The revision with features as a dictionary.
 
         """
-        text = self.parser.parse(content)
+        if self.max_bytes is not None and len(content.encode("utf-8")) > self.max_bytes:
+            return self.approximate_content(content)
+        deadline = None
+        if self.time_budget is not None:
+            deadline = time.perf_counter() + self.time_budget
+
+        with metrics.timer("parse"):
+            text = self.parser.parse(content)
+        if deadline is not None and time.perf_counter() > deadline:
+            return self.approximate_content(content)
 
         revision = {}
 
         # Content characters are visible characters. Operationalized as characters after
-        plaintext = text.strip_code()
+        with metrics.timer("strip_code"):
+            plaintext = text.strip_code()
+        if deadline is not None and time.perf_counter() > deadline:
+            return self.approximate_content(content)
 
         # Real Content
 
         # Sections
-        words = [tok for tok in self.nlp(plaintext) if is_word(tok)]
         # always at least one word
-        revision["words"] = len(words) + 1
-
-        # Headings
-
-        # Total number of headings
-        headings = text.filter_headings()
-        revision["headings"] = len([x for x in headings if x.level == 2])
-
-        # Sub-headings
-        revision["sub_headings"] = len([x for x in headings if x.level > 2])
-
-        # Number of wikilinks
-        wikilinks = text.filter_wikilinks()
-
-        # number of images
-        revision["images"] = sum(
-            [wikilink_title_matches(r"file|image\:", link) for link in wikilinks]
-        )
-
-        # number of categories
-        revision["categories"] = sum(
-            [wikilink_title_matches("category\:", link) for link in wikilinks]
-        )
-
-        # Other wikilinks
-        special_links = sum(revision[k] for k in ("images", "categories"))
-        revision["wikilinks"] = len(wikilinks) - special_links
-
-        # external links
-        revision["external_links"] = len(text.filter_external_links())
-
-        # Templates
-        templates = text.filter_templates()
-
-        # main templates
-        revision["main_templates"] = sum(
-            [match_template(x, "main$") for x in templates]
-        )
+        with metrics.timer("count_words"):
+            revision["words"] = self.count_words(plaintext) + 1
 
-        # citation templates
-        revision["cite_templates"] = sum([match_template(x, "cite") for x in templates])
-
-        # infoboxes
-        revision["infoboxes"] = sum([match_template(x, "infobox") for x in templates])
-
-        # other templates
-        revision["templates"] = len(templates)
-
-        backlog_sections = {
-            "Accuracy": "backlog_accuracy",
-            "Content": "backlog_content",
-            "Style": "backlog_style",
-            "File": "backlog_files",
-            "Other": "backlog_other",
-            "Links": "backlog_links",
-        }
-        backlog_issues = get_backlog_features(text)
-        for k, v in backlog_sections.items():
-            if len(backlog_issues[k]):
-                revision[v] = sum(backlog_issues[k].values())
-                revision[f"{v}_templates"] = " ".join(backlog_issues[k].keys())
-            else:
-                revision[v] = 0
-                revision[f"{v}_templates"] = None
-
-        # number of ref tags
-        revision["ref"] = len([x for x in text.filter_tags() if x.tag == "ref"])
+        # Headings, links, templates, backlog issues, and ref tags
+        with metrics.timer("count_nodes"):
+            revision.update(count_nodes(text))
 
         # number of smartlists (e.g. wikitables)
         revision["smartlists"] = len(
@@ -196,7 +502,7 @@ class Featurizer:
         )
 
         # is there a map
-        revision["coordinates"] = "#coordinates" in str(text).lower()
+        revision["coordinates"] = bool(_COORDINATES_RE.search(content))
 
         # Add plaintext for more features
         revision["text"] = plaintext
@@ -206,6 +512,99 @@ class Featurizer:
 
         return revision
 
+    def _sample_count_words(self, text: str) -> int:
+        # The regex counter is fast enough to count everything
+        if self.word_counter == "regex" or len(text) <= APPROX_SAMPLE_CHARS:
+            return self.count_words(text)
+        width = APPROX_SAMPLE_CHARS // _APPROX_SAMPLES
+        step = len(text) / _APPROX_SAMPLES
+        words = 0
+        sampled = 0
+        for i in range(_APPROX_SAMPLES):
+            chunk = text[int(i * step) : int(i * step) + width]
+            words += self.count_words(chunk)
+            sampled += len(chunk)
+        return round(words * len(text) / sampled)
+
+    def approximate_content(self, content: str) -> Dict:
+        """Create approximate features of a revision without parsing it.
+
+        This takes time roughly linear in the length of ``content``. Nodes
+        are counted with :func:`count_nodes_regex`, the plain text is
+        approximated with :func:`strip_markup`, and words are counted in
+        evenly spaced samples of :data:`APPROX_SAMPLE_CHARS` characters of
+        it. The features have the keys of those of :meth:`parse_content`,
+        and also ``"approximate"``, which is true. Exact features do not have
+        that key, so that they are stored without it.
+        """
+        with metrics.timer("approximate"):
+            plaintext = strip_markup(content)
+            # always at least one word
+            revision = {"words": self._sample_count_words(plaintext) + 1}
+            revision.update(count_nodes_regex(content))
+            # No top-level node is a SmartList, so parse_content counts none
+            revision["smartlists"] = 0
+            revision["coordinates"] = bool(_COORDINATES_RE.search(content))
+            revision["text"] = plaintext
+            revision["approximate"] = True
+        return revision
+
+    def _count_section(self, section: str) -> Tuple[Counter, Dict[str, Counter]]:
+        text = self.parser.parse(section)
+        counts, backlog_issues = _walk_nodes(text)
+        counts["words"] = self.count_words(text.strip_code())
+        counts["smartlists"] = len(
+            [x for x in text.nodes if isinstance(x, mwparser.smart_list.SmartList)]
+        )
+        counts["coordinates"] = int(bool(_COORDINATES_RE.search(section)))
+        return counts, backlog_issues
+
+    def iter_history(self, contents: Iterable[str]) -> Generator[Dict, None, None]:
+        """Create features for consecutive revisions of a page.
+
+        Most edits only change a few sections of a page. Each revision is
+        split into sections with :func:`split_sections`, and only the
+        sections which are not in the previous revision are parsed. The
+        features of the revision are the sums of the counts of its sections.
+
+        This gives the same features as :meth:`parse_content`, without
+        ``text``, unless a template, tag, or comment spans a heading, since
+        each section is parsed separately. The size and time budgets of the
+        featurizer are not used.
+
+        Parameters
+        -----------
+        contents:
+            The content of each revision, in order.
+
+        Yields
+        -------
+        dict:
+            The features of each revision.
+
+        """
+        previous = {}
+        for content in contents:
+            sections = {}
+            counts = Counter()
+            backlog_issues = {k: Counter() for k in set(get_backlog_table().values())}
+            for section in split_sections(content):
+                if section not in sections:
+                    sections[section] = previous.get(section)
+                if sections[section] is None:
+                    sections[section] = self._count_section(section)
+                section_counts, section_issues = sections[section]
+                counts.update(section_counts)
+                for k, v in section_issues.items():
+                    backlog_issues[k].update(v)
+            previous = sections
+            # always at least one word
+            revision = {"words": counts["words"] + 1}
+            revision.update(_node_features(counts, backlog_issues))
+            revision["smartlists"] = counts["smartlists"]
+            revision["coordinates"] = counts["coordinates"] > 0
+            yield revision
+
 
 def load_wp10(input_file: str) -> pd.DataFrame:
     """Load wp10 data with features from a csv file"""
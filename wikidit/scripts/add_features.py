@@ -1,54 +1,221 @@
-"""Add features to the training/test data."""
+"""Add features to the training/test data.
+
+Revisions are streamed from the input file in chunks, featurized by a pool of
+processes, and written in their original order, so memory use does not depend
+on the size of the input. The output is either one NDJSON file per WP10 class,
+or Parquet files with the text stored separately from the features.
+"""
+import collections
 import gzip
 import argparse
+import hashlib
 import json
 import logging
+import os
 import os.path
+import re
+from contextlib import ExitStack
+from multiprocessing import Pool
 
-from joblib import Parallel, delayed
-
-from ..io import load_ndjson
-from ..preprocessing import Featurizer, WP10_LABELS
+from ..cache import make_cache
+from ..io import load_ndjson, write_labeled_parquet
+from ..preprocessing import Featurizer, WP10_LABELS, WORD_COUNTERS
+from ..utils import imap_bounded, split_seq
 
 logger = logging.getLogger(__name__)
 
 
-def read_labeling_revisions(filename):
-    groups = {k: [] for k in WP10_LABELS}
+def iter_labeling_revisions(filename, chunksize=100):
+    """Iterate over chunks of ``chunksize`` revisions in ``filename``."""
     with gzip.open(filename, "rt") as f:
-        for row in load_ndjson(f):
-            groups[row["wp10"]].append(row)
-    return groups
+        yield from split_seq(load_ndjson(f), chunksize)
+
+
+# Each worker process creates one featurizer and reuses it for all chunks
+_featurizer = None
+
+
+def _init_worker(word_counter="spacy"):
+    global _featurizer
+    _featurizer = Featurizer(word_counter=word_counter)
+
+
+def featurize_chunk(contents):
+    return [_featurizer.parse_content(x) for x in contents]
+
+
+def content_key(row, version):
+    """Key of the features of a revision in the featurization cache."""
+    sha1 = row.get("sha1")
+    if not sha1:
+        sha1 = hashlib.sha1(row["wikitext"].encode("utf-8")).hexdigest()
+    return f"{version}:{sha1}"
+
+
+OUTPUT_FORMATS = ("ndjson", "parquet")
 
+_MANIFEST = "add_features.json"
 
-def process(output_dir, wp10, data):
-    featurizer = Featurizer()
-    filename = os.path.join(output_dir, f"{wp10}.ndjson.gz")
-    with gzip.open(filename, "wt") as f:
-        for x in data:
-            newx = featurizer.featurize(x, content="wikitext")
-            f.write(json.dumps(newx) + "\n")
 
+def _completed_parts(output_dir):
+    """Numbers of the Parquet parts which were completely written."""
+    parts = []
+    for subdir in ("features", "text"):
+        try:
+            filenames = os.listdir(os.path.join(output_dir, subdir))
+        except FileNotFoundError:
+            return set()
+        parts.append(
+            {int(f[5:10]) for f in filenames if re.match(r"part-\d{5}\.parquet$", f)}
+        )
+    return set.intersection(*parts)
 
-def run(input_file, output_dir, n_jobs=1):
+
+def _remove_parts(output_dir, parts):
+    for subdir in ("features", "text"):
+        for i in parts:
+            os.remove(os.path.join(output_dir, subdir, f"part-{i:05d}.parquet"))
+
+
+def run(
+    input_file,
+    output_dir,
+    n_jobs=1,
+    word_counter="spacy",
+    chunksize=100,
+    output_format="ndjson",
+    cache=None,
+    resume=False,
+):
+    """Add features to the revisions in ``input_file``.
+
+    If ``cache`` is the path of a SQLite database, features are cached by the
+    SHA-1 of the revision content and the featurizer version, so that
+    re-running only featurizes new revisions or revisions featurized by
+    another version of the code. If ``resume`` is true, Parquet parts written
+    by an earlier run with the same settings are kept, and only the missing
+    parts are written. NDJSON files are always rewritten.
+    """
     if os.path.exists(output_dir):
         logging.warning(f"{output_dir} already exists")
     else:
         logging.info(f"Creating {output_dir}")
     os.makedirs(output_dir, exist_ok=True)
-    data = read_labeling_revisions(input_file)
-    exc = Parallel(n_jobs=n_jobs)
-    exc(delayed(process)(output_dir, *x) for x in data.items())
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() + 1 + n_jobs
+    version = Featurizer(word_counter=word_counter).version
+    if cache is not None:
+        cache = make_cache(cache, maxsize=None)
+
+    done = set()
+    if output_format == "parquet":
+        # The manifest records the settings of the parts, so that parts are
+        # only kept if they were written with the same settings. NDJSON files
+        # are always rewritten, so they have none.
+        manifest = {"version": version, "chunksize": chunksize, "format": output_format}
+        manifest_file = os.path.join(output_dir, _MANIFEST)
+        try:
+            with open(manifest_file, "r") as f:
+                previous = json.load(f)
+        except FileNotFoundError:
+            previous = None
+        done = _completed_parts(output_dir)
+        if not (resume and previous == manifest):
+            _remove_parts(output_dir, done)
+            done = set()
+        logger.info(f"Skipping {len(done)} completed parts")
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f)
+
+    # Chunks submitted to the pool, in order, with any cached features
+    pending = collections.deque()
+
+    def uncached_contents(chunks):
+        for i, rows in enumerate(chunks):
+            if i in done:
+                continue
+            if cache is None:
+                keys = features = [None] * len(rows)
+            else:
+                keys = [content_key(x, version) for x in rows]
+                features = [cache.get(k) for k in keys]
+            pending.append((i, rows, keys, features))
+            yield [x["wikitext"] for x, y in zip(rows, features) if y is None]
+
+    chunks = iter_labeling_revisions(input_file, chunksize=chunksize)
+    with ExitStack() as stack:
+        if output_format == "parquet":
+
+            def write(i, rows):
+                write_labeled_parquet(rows, output_dir, i)
+
+        else:
+            files = {
+                wp10: stack.enter_context(
+                    gzip.open(os.path.join(output_dir, f"{wp10}.ndjson.gz"), "wt")
+                )
+                for wp10 in WP10_LABELS
+            }
+
+            def write(i, rows):
+                for x in rows:
+                    files[x["wp10"]].write(json.dumps(x) + "\n")
+
+        if n_jobs > 1:
+            pool = stack.enter_context(
+                Pool(n_jobs, initializer=_init_worker, initargs=(word_counter,))
+            )
+        else:
+            pool = None
+            _init_worker(word_counter)
+        n = 0
+        n_cached = 0
+        featurized = imap_bounded(
+            featurize_chunk,
+            uncached_contents(chunks),
+            pool=pool,
+            max_pending=2 * n_jobs,
+        )
+        for computed in featurized:
+            i, rows, keys, features = pending.popleft()
+            computed = iter(computed)
+            new = []
+            for j, y in enumerate(features):
+                if y is None:
+                    features[j] = next(computed)
+                    new.append((keys[j], features[j]))
+            if cache is not None:
+                cache.set_many(new)
+            write(i, [{**x, **y} for x, y in zip(rows, features)])
+            n += len(rows)
+            n_cached += len(rows) - len(new)
+            logger.info(f"Featurized {n} revisions ({n_cached} cached)")
 
 
 def main():
-    logging.basicConfig()
+    logging.basicConfig(level=logging.INFO)
     parser = argparse.ArgumentParser()
     parser.add_argument("input")
     parser.add_argument("output")
     parser.add_argument("-j", "--n-jobs", type=int, default=1)
+    parser.add_argument("--word-counter", choices=WORD_COUNTERS, default="spacy")
+    parser.add_argument("--chunksize", type=int, default=100)
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="ndjson")
+    parser.add_argument("--cache", help="SQLite database to cache features in")
+    parser.add_argument(
+        "--resume", action="store_true", help="Keep completed Parquet parts"
+    )
     args = parser.parse_args()
-    run(args.input, args.output, n_jobs=args.n_jobs)
+    run(
+        args.input,
+        args.output,
+        n_jobs=args.n_jobs,
+        word_counter=args.word_counter,
+        chunksize=args.chunksize,
+        output_format=args.format,
+        cache=args.cache,
+        resume=args.resume,
+    )
 
 
 if __name__ == "__main__":
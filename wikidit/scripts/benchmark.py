@@ -0,0 +1,325 @@
+"""Benchmark featurization and scoring on a sample of labeled revisions.
+
+A stratified sample of revisions from each WP10 class is drawn from labeled
+NDJSON files, e.g. the downloaded training revisions or the per-class output
+of ``add_features``, so the benchmarks run offline. The benchmarks measure
+
+- the latency of each stage of featurizing and scoring a revision: parsing,
+  ``strip_code``, counting words, counting templates and other nodes, the
+  whole of ``Featurizer.parse_content``, scoring, and the edit
+  counterfactuals of ``predict_page_edits``,
+- the throughput of the batch featurization and scoring in revisions per
+  second, and
+- the peak memory allocated while featurizing and scoring.
+
+Results can be saved as JSON and compared to the results of an earlier run.
+The command fails if any latency or memory measurement increased, or any
+throughput decreased, by more than ``--max-regression``.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os.path
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+from ..io import load_ndjson
+from ..models import get_model, load_model, predict_page_edits, score_revisions
+from ..preprocessing import Featurizer, WP10_LABELS, WORD_COUNTERS, count_nodes
+
+logger = logging.getLogger(__name__)
+
+
+def _labeled_files(paths: Iterable[str]) -> List[str]:
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(
+                os.path.join(path, f)
+                for f in sorted(os.listdir(path))
+                if f.endswith(".ndjson.gz")
+            )
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def sample_revisions(
+    paths: Iterable[str], n_per_class: int = 20, seed: int = 0
+) -> List[Dict]:
+    """Draw a stratified random sample of labeled revisions.
+
+    Parameters
+    -----------
+    paths:
+        Gzipped NDJSON files, or directories of them, with the ``wp10`` class
+        and ``wikitext`` of each revision.
+    n_per_class:
+        Number of revisions sampled from each WP10 class.
+    seed:
+        Seed of the random number generator.
+
+    Returns
+    --------
+    list
+        The sampled revisions, ordered by class. Each class is sampled with
+        reservoir sampling, so only the sample is held in memory.
+
+    """
+    rng = random.Random(seed)
+    samples = {k: [] for k in WP10_LABELS}
+    seen = {k: 0 for k in WP10_LABELS}
+    for filename in _labeled_files(paths):
+        with gzip.open(filename, "rt") as f:
+            for row in load_ndjson(f):
+                label = row.get("wp10")
+                if label not in samples:
+                    continue
+                seen[label] += 1
+                if len(samples[label]) < n_per_class:
+                    samples[label].append(row)
+                else:
+                    i = rng.randrange(seen[label])
+                    if i < n_per_class:
+                        samples[label][i] = row
+    for label, rows in samples.items():
+        if len(rows) < n_per_class:
+            logger.warning(f"Only {len(rows)} revisions of class {label}")
+    return [row for label in WP10_LABELS for row in samples[label]]
+
+
+def _latency(func: Callable, inputs: List, repeat: int = 1) -> Dict:
+    times = []
+    outputs = []
+    for x in inputs:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = func(x)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        outputs.append(out)
+    times = np.array(times) * 1000
+    return {
+        "median_ms": float(np.median(times)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "mean_ms": float(np.mean(times)),
+    }, outputs
+
+
+def time_stages(
+    revisions: List[Dict], featurizer: Featurizer, model=None, repeat: int = 1
+) -> Dict[str, Dict]:
+    """Measure the latency of each stage for each revision.
+
+    Each stage is timed separately on the outputs of the previous stage.
+    The time of a revision is the minimum over ``repeat`` runs. If ``model``
+    is ``None``, the scoring stages are skipped.
+    """
+    contents = [x["wikitext"] for x in revisions]
+    results = {}
+    results["parse"], parsed = _latency(featurizer.parser.parse, contents, repeat)
+    results["strip_code"], plaintexts = _latency(
+        lambda x: x.strip_code(), parsed, repeat
+    )
+    results["count_words"], _ = _latency(featurizer.count_words, plaintexts, repeat)
+    results["count_nodes"], _ = _latency(count_nodes, parsed, repeat)
+    results["parse_content"], features = _latency(
+        featurizer.parse_content, contents, repeat
+    )
+    if model is not None:
+        for x in features:
+            del x["text"]
+        results["score"], _ = _latency(model.predict_proba, features, repeat)
+        results["predict_page_edits"], _ = _latency(
+            lambda x: predict_page_edits(x, featurizer, model), contents, repeat
+        )
+    return results
+
+
+def measure_throughput(
+    revisions: List[Dict], model=None, n_jobs: int = 1, word_counter: str = "spacy"
+) -> Dict[str, float]:
+    """Measure the revisions per second of batch featurization and scoring."""
+    contents = [x["wikitext"] for x in revisions]
+    featurizer = Featurizer(word_counter=word_counter)
+    results = {}
+    start = time.perf_counter()
+    for content in contents:
+        featurizer.parse_content(content)
+    results["featurize_per_s"] = len(contents) / (time.perf_counter() - start)
+    if model is not None:
+        start = time.perf_counter()
+        score_revisions(contents, model, n_jobs=n_jobs, word_counter=word_counter)
+        results["score_revisions_per_s"] = len(contents) / (
+            time.perf_counter() - start
+        )
+    return results
+
+
+def _peak_mb(func: Callable, x) -> float:
+    # Restarting tracemalloc resets the peak
+    tracemalloc.start()
+    try:
+        func(x)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def measure_memory(
+    revisions: List[Dict], featurizer: Featurizer, model=None
+) -> Dict[str, float]:
+    """Measure the peak memory allocated by Python while featurizing.
+
+    Memory is traced with :mod:`tracemalloc`, which only sees allocations
+    made through Python, and the peak is the largest of any one revision.
+    """
+    contents = [x["wikitext"] for x in revisions]
+    results = {
+        "parse_content_peak_mb": max(
+            _peak_mb(featurizer.parse_content, x) for x in contents
+        )
+    }
+    if model is not None:
+        results["predict_page_edits_peak_mb"] = max(
+            _peak_mb(lambda x: predict_page_edits(x, featurizer, model), x)
+            for x in contents
+        )
+    return results
+
+
+def _flatten(results: Dict) -> Dict[str, float]:
+    flat = {}
+    for stage, values in results["latency"].items():
+        for k, v in values.items():
+            flat[f"latency.{stage}.{k}"] = v
+    for group in ("throughput", "memory"):
+        for k, v in results[group].items():
+            flat[f"{group}.{k}"] = v
+    return flat
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float = 0.2) -> List[str]:
+    """Find the measurements which regressed compared to ``baseline``.
+
+    Latency and memory regress if they increase, throughput if it decreases,
+    by more than the fraction ``max_regression``.
+    """
+    new = _flatten(results)
+    old = _flatten(baseline)
+    regressions = []
+    for k, v in new.items():
+        if k not in old or not old[k]:
+            continue
+        change = v / old[k] - 1
+        if k.startswith("throughput."):
+            change = -change
+        if change > max_regression:
+            regressions.append(f"{k}: {old[k]:.4g} -> {v:.4g} ({change:+.0%})")
+    return regressions
+
+
+def run(
+    paths,
+    n_per_class=20,
+    seed=0,
+    word_counter="spacy",
+    model_file=None,
+    score=True,
+    n_jobs=1,
+    repeat=1,
+    output=None,
+    baseline=None,
+    max_regression=0.2,
+):
+    """Run the benchmarks and return the results and any regressions."""
+    revisions = sample_revisions(paths, n_per_class=n_per_class, seed=seed)
+    logger.info(f"Sampled {len(revisions)} revisions")
+    featurizer = Featurizer(word_counter=word_counter)
+    model = None
+    if score:
+        model = load_model(model_file) if model_file else get_model()
+    # Warm up lazily loaded resources, e.g. the spaCy pipeline
+    featurizer.parse_content(revisions[0]["wikitext"])
+
+    results = {
+        "settings": {
+            "n_revisions": len(revisions),
+            "n_per_class": n_per_class,
+            "seed": seed,
+            "word_counter": word_counter,
+            "n_jobs": n_jobs,
+        },
+        "latency": time_stages(revisions, featurizer, model, repeat=repeat),
+        "throughput": measure_throughput(
+            revisions, model, n_jobs=n_jobs, word_counter=word_counter
+        ),
+        "memory": measure_memory(revisions, featurizer, model),
+    }
+    for k, v in _flatten(results).items():
+        logger.info(f"{k}: {v:.4g}")
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    regressions = []
+    if baseline is not None:
+        with open(baseline, "r") as f:
+            regressions = compare(results, json.load(f), max_regression)
+        for x in regressions:
+            logger.error(f"Regression in {x}")
+    return results, regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "input", nargs="+", help="Labeled NDJSON files or directories of them"
+    )
+    parser.add_argument("-n", "--n-per-class", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--word-counter", choices=WORD_COUNTERS, default="spacy")
+    parser.add_argument("--model", help="Model file or directory")
+    parser.add_argument(
+        "--no-score", action="store_true", help="Only benchmark featurization"
+    )
+    parser.add_argument("-j", "--n-jobs", type=int, default=1)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Runs per revision, the fastest is kept"
+    )
+    parser.add_argument("-o", "--output", help="Save the results as JSON")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare to")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Largest allowed relative change compared to the baseline",
+    )
+    args = parser.parse_args()
+    _, regressions = run(
+        args.input,
+        n_per_class=args.n_per_class,
+        seed=args.seed,
+        word_counter=args.word_counter,
+        model_file=args.model,
+        score=not args.no_score,
+        n_jobs=args.n_jobs,
+        repeat=args.repeat,
+        output=args.output,
+        baseline=args.baseline,
+        max_regression=args.max_regression,
+    )
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,196 @@
 # coding: utf-8
-"""Download metadata and texts for WP10 Quality sample."""
+"""Download metadata and texts for WP10 Quality sample.
+
+Chunks of revisions are requested concurrently and written in order. After
+each chunk is written, a checkpoint file next to the output records how many
+chunks are complete, so an interrupted download resumes where it stopped.
+"""
+import argparse
+import collections
+import contextlib
 import gzip
+import itertools
 import json
+import logging
+import os
 import os.path
-import argparse
-
-import mwapi
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from ..utils import split_seq
-from ..mw import Session
-
-
-def run(input_file, output_file, chunksize=50):
-    # Possible rvprop
-    # - ids: Get the revid and, from 1.16 onward, the parentid. 1.11+
-    # - roles: List content slot roles that exist in the revision. 1.32+
-    # - flags: Whether the revision was a minor edit. 1.11+
-    # - timestamp: The date and time the revision was made, in ISO 8601 combined date and time format.
-    # - user: The user who made the revision, and if applicable, the flags: userhidden if revision deleted and/or anon if unregistered.
-    # - userid: User id of revision creator, as well as userhidden and anon flags. 1.17+
-    # - size: The size of the revision text in bytes. 1.11+
-    # - sha1: SHA-1 (base 16) of the revision. 1.19+
-    # - contentmodel: Content model id of the revision. 1.21+
-    # - comment: The edit comment.
-    # - parsedcomment: The edit/log comment in HTML format with wikilinks and section references expanded into hyperlinks 1.16+
-    # - content: The revision content. If set, the maximum limit will be 10 times as low. (Note: If you want HTML rather than wikitext, use action=parse instead.)
-    # - tags: Any tags for this revision, such as those added by AbuseFilter. 1.16+
-    rvprop = "content|comment|sha1|size|userid|user|timestamp|flags|ids"
-
-    session = Session()
+from ..mw import Session, get_with_retries
+
+logger = logging.getLogger(__name__)
+
+# Possible rvprop
+# - ids: Get the revid and, from 1.16 onward, the parentid. 1.11+
+# - roles: List content slot roles that exist in the revision. 1.32+
+# - flags: Whether the revision was a minor edit. 1.11+
+# - timestamp: The date and time the revision was made, in ISO 8601 combined date and time format.
+# - user: The user who made the revision, and if applicable, the flags: userhidden if revision deleted and/or anon if unregistered.
+# - userid: User id of revision creator, as well as userhidden and anon flags. 1.17+
+# - size: The size of the revision text in bytes. 1.11+
+# - sha1: SHA-1 (base 16) of the revision. 1.19+
+# - contentmodel: Content model id of the revision. 1.21+
+# - comment: The edit comment.
+# - parsedcomment: The edit/log comment in HTML format with wikilinks and section references expanded into hyperlinks 1.16+
+# - content: The revision content. If set, the maximum limit will be 10 times as low. (Note: If you want HTML rather than wikitext, use action=parse instead.)
+# - tags: Any tags for this revision, such as those added by AbuseFilter. 1.16+
+RVPROP = "content|comment|sha1|size|userid|user|timestamp|flags|ids"
+
+
+def fetch_chunk(session, revids, maxlag=5, retries=5):
+    """Download the revisions ``revids`` and return them as NDJSON lines."""
+    r = get_with_retries(
+        session,
+        retries=retries,
+        action="query",
+        revids="|".join(str(x) for x in revids),
+        prop="revisions",
+        rvprop=RVPROP,
+        rvslots="main",
+        maxlag=maxlag,
+    )
+    lines = []
+    for page in r["query"]["pages"].values():
+        for revision in page["revisions"]:
+            # A few of these revisions have had their content removed
+            try:
+                revision["wikitext"] = revision["slots"]["main"]["*"]
+            except KeyError:
+                logger.warning(f"No content for revision {revision.get('revid')}")
+                continue
+            del revision["slots"]
+            for k in ("pageid", "ns", "title"):
+                revision[k] = page[k]
+            lines.append(json.dumps(revision) + "\n")
+    return "".join(lines)
+
 
+def _read_checkpoint(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(filename, checkpoint):
+    with open(filename + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def run(
+    input_file,
+    output_file,
+    chunksize=50,
+    concurrency=4,
+    maxlag=5,
+    retries=5,
+    host=Session._HOSTNAME,
+):
+    """Download the revisions listed in ``input_file`` to ``output_file``.
+
+    Parameters
+    -----------
+    input_file:
+        JSON lines with ``rev_id`` and ``wp10`` for each revision.
+    output_file:
+        Gzipped NDJSON file with the revisions.
+    chunksize:
+        Number of revisions per request. The API allows at most 50.
+    concurrency:
+        Maximum number of requests in flight.
+    maxlag:
+        Value of the ``maxlag`` API parameter. Requests are retried when the
+        replication lag of the servers is larger.
+    retries:
+        Maximum number of retries per request.
+    host:
+        Host of the MediaWiki API.
+
+    """
     with open(input_file, "r") as f:
         revisions = {x["rev_id"]: x["wp10"] for x in [json.loads(line) for line in f]}
+    chunks = list(split_seq(revisions, chunksize))
+
+    checkpoint_file = f"{output_file}.checkpoint"
+    checkpoint = _read_checkpoint(checkpoint_file)
+    if checkpoint is None:
+        if os.path.exists(output_file):
+            raise FileExistsError(f"{output_file} exists")
+        checkpoint = {"chunksize": chunksize, "chunks": 0, "offset": 0}
+    elif checkpoint["chunksize"] != chunksize:
+        raise ValueError(
+            f"{output_file} was downloaded with chunksize {checkpoint['chunksize']}"
+        )
+    start = checkpoint["chunks"]
+    if start:
+        logger.info(f"Resuming from chunk {start} of {len(chunks)}")
+
+    # mwapi sessions should not be shared between threads
+    local = threading.local()
+
+    def fetch(revids):
+        if not hasattr(local, "session"):
+            local.session = Session(host)
+        return fetch_chunk(local.session, revids, maxlag=maxlag, retries=retries)
 
-    if os.path.exists(output_file):
-        raise FileExistsError(f"{output_file} exists")
-
-    with gzip.open(output_file, "wt") as f:
-        for i, rev_id in enumerate(split_seq(revisions, chunksize)):
-            print(f"downloading chunk {i}")
-            revids = "|".join(str(x) for x in rev_id)
-            r = session.get(
-                action="query",
-                revids=revids,
-                prop="revisions",
-                rvprop=rvprop,
-                rvslots="main",
+    n_revisions = 0
+    started = time.time()
+    with open(output_file, "ab") as f, ThreadPoolExecutor(concurrency) as executor:
+        # Remove anything written after the last checkpoint
+        f.truncate(checkpoint["offset"])
+        f.seek(checkpoint["offset"])
+        # Submit chunks lazily so that at most 2 * concurrency are in memory
+        remaining = iter(chunks[start:])
+        pending = collections.deque(
+            executor.submit(fetch, c)
+            for c in itertools.islice(remaining, 2 * concurrency)
+        )
+        for i in range(start, len(chunks)):
+            lines = pending.popleft().result()
+            for c in itertools.islice(remaining, 1):
+                pending.append(executor.submit(fetch, c))
+            # Each chunk is a separate gzip member, which can be concatenated
+            f.write(gzip.compress(lines.encode("utf-8")))
+            f.flush()
+            checkpoint["chunks"] = i + 1
+            checkpoint["offset"] = f.tell()
+            _write_checkpoint(checkpoint_file, checkpoint)
+            n_revisions += lines.count("\n")
+            elapsed = time.time() - started
+            logger.info(
+                f"Downloaded chunk {i + 1}/{len(chunks)}: {n_revisions} revisions "
+                f"in {elapsed:.0f}s ({n_revisions / elapsed:.1f} revisions/s)"
             )
-            pages = r["query"]["pages"]
-            for page in pages.values():
-                for revision in page["revisions"]:
-                    # A few of these revisions have had their content removed
-                    try:
-                        revision["wikitext"] = revision["slots"]["main"]["*"]
-                    except KeyError:
-                        print(revision)
-                        continue
-                    del revision["slots"]
-                    for k in ("pageid", "ns", "title"):
-                        revision[k] = page[k]
-                    f.write(json.dumps(revision) + "\n")
+    # No checkpoint is written if there were no chunks to download
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint_file)
 
 
 def main():
+    logging.basicConfig(level=logging.INFO)
     parser = argparse.ArgumentParser()
     parser.add_argument("input")
     parser.add_argument("output")
+    parser.add_argument("--chunksize", type=int, default=50)
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=4, help="Requests in flight"
+    )
+    parser.add_argument("--maxlag", type=int, default=5)
+    parser.add_argument("--retries", type=int, default=5)
     args = parser.parse_args()
-    run(args.input, args.output)
+    run(
+        args.input,
+        args.output,
+        chunksize=args.chunksize,
+        concurrency=args.concurrency,
+        maxlag=args.maxlag,
+        retries=args.retries,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+"""Export the pickled quality model for inference without unpickling."""
+import argparse
+import gzip
+import itertools
+import logging
+
+import pandas as pd
+
+from ..compiled import EXPORT_FORMATS, CompiledModel, check_model, export_model
+from ..io import load_ndjson
+from ..models import load_model
+
+logger = logging.getLogger(__name__)
+
+
+def read_revisions(filename, n=1000):
+    """Read the first ``n`` featurized revisions in an NDJSON file."""
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt") as f:
+        rows = list(itertools.islice(load_ndjson(f), n))
+    return pd.DataFrame.from_records(rows)
+
+
+def run(output_dir, model_file=None, format="json", check=None):
+    """Export the model in ``model_file`` to ``output_dir``.
+
+    If ``check`` is an NDJSON file of featurized revisions, e.g. written by
+    :mod:`wikidit.scripts.add_features`, check that the exported model
+    predicts the same probabilities for them.
+    """
+    model = load_model(model_file)
+    export_model(model, output_dir, format=format)
+    logger.info(f"Exported model to {output_dir}")
+    if check is not None:
+        X = read_revisions(check)
+        check_model(model, CompiledModel.load(output_dir), X)
+        logger.info(f"The exported model predicts {len(X)} revisions like the model")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", help="Directory to export the model to")
+    parser.add_argument("--model", help="Pickled model (default: packaged model)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="json")
+    parser.add_argument(
+        "--check",
+        help="NDJSON file of featurized revisions to compare the predictions on",
+    )
+    args = parser.parse_args()
+    run(args.output, model_file=args.model, format=args.format, check=args.check)
+
+
+if __name__ == "__main__":
+    main()
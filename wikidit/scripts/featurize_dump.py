@@ -0,0 +1,247 @@
+"""Featurize the revisions in Wikipedia XML dumps.
+
+The dump is split into shards which are processed by a pool of processes.
+Either each dump file is a shard, e.g. for the numbered
+``pages-articles{n}.xml-p{start}p{end}.bz2`` or ``pages-meta-history`` files,
+or, with ``--index``, a ``pages-articles-multistream`` dump is split into
+groups of bz2 streams using its index.
+
+Pages and revisions are streamed from the dump, and the features of each
+shard are written in batches to ``{output}/part-{shard}.parquet``, so memory
+use does not depend on the size of a page history or of the dump. The
+features are written without the text of the revisions. Completed parts are
+skipped if the command is re-run. A shard without revisions is written as an
+empty file, so it is skipped too.
+"""
+import argparse
+import logging
+import os
+import os.path
+from multiprocessing import Pool
+
+import pandas as pd
+
+from ..mw import iter_multistream_pages, open_dump, read_multistream_index
+from ..preprocessing import BACKLOG_SECTIONS, Featurizer, WORD_COUNTERS
+from ..utils import split_seq
+
+logger = logging.getLogger(__name__)
+
+REVISION_COLUMNS = ("rev_id", "timestamp", "page_id", "page_title")
+"""Metadata of the revisions written with their features."""
+
+COUNT_COLUMNS = (
+    "words",
+    "headings",
+    "sub_headings",
+    "images",
+    "categories",
+    "wikilinks",
+    "external_links",
+    "main_templates",
+    "cite_templates",
+    "infoboxes",
+    "templates",
+    *BACKLOG_SECTIONS.values(),
+    "ref",
+    "smartlists",
+)
+"""Features of :meth:`wikidit.preprocessing.Featurizer.parse_content` which
+are counts."""
+
+
+def parquet_schema():
+    """Return the Arrow schema of the files written by :func:`featurize_shard`.
+
+    The schema is fixed, rather than inferred from the revisions, so that all
+    parts have the same schema even if, e.g., no revision in a part has a
+    backlog template.
+    """
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("rev_id", pa.int64()),
+            ("timestamp", pa.string()),
+            ("page_id", pa.int64()),
+            ("page_title", pa.string()),
+            *((name, pa.int64()) for name in COUNT_COLUMNS),
+            *((f"{name}_templates", pa.string()) for name in BACKLOG_SECTIONS.values()),
+            ("coordinates", pa.bool_()),
+        ]
+    )
+
+
+def iter_dump_revisions(pages, namespaces=(0,), redirects=False):
+    """Iterate over the revisions of ``pages`` as dictionaries.
+
+    Revisions are yielded one at a time as they are read from the dump.
+    Pages outside ``namespaces``, redirects (unless ``redirects`` is true),
+    and revisions with deleted text are skipped.
+    """
+    for page in pages:
+        if namespaces is not None and page.namespace not in namespaces:
+            continue
+        if page.redirect and not redirects:
+            continue
+        for rev in page:
+            if rev.text is None:
+                continue
+            yield {
+                "rev_id": rev.id,
+                "timestamp": str(rev.timestamp),
+                "page_id": page.id,
+                "page_title": page.title,
+                "wikitext": rev.text,
+            }
+
+
+def _shard_pages(shard):
+    kind, source = shard
+    if kind == "file":
+        return open_dump(source)
+    filename, offsets = source
+    return iter_multistream_pages(filename, offsets)
+
+
+def featurize_shard(
+    shard, filename, word_counter="spacy", batch_size=1000, namespaces=(0,)
+):
+    """Featurize the revisions in a shard and write them to ``filename``.
+
+    The features are written in row groups of ``batch_size`` revisions, with
+    the schema :func:`parquet_schema`. The file is written to a temporary
+    file first, so it is either complete or missing. Returns the number of
+    revisions.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    featurizer = Featurizer(word_counter=word_counter)
+    revisions = iter_dump_revisions(_shard_pages(shard), namespaces=namespaces)
+    n = 0
+    writer = pq.ParquetWriter(filename + ".tmp", schema)
+    try:
+        for batch in split_seq(revisions, batch_size):
+            rows = []
+            for rev in batch:
+                features = featurizer.parse_content(rev.pop("wikitext"))
+                rows.append({**rev, **features})
+            # Other columns, e.g. the text, are not written
+            df = pd.DataFrame.from_records(rows, columns=schema.names)
+            writer.write_table(
+                pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            )
+            n += len(rows)
+    finally:
+        writer.close()
+    os.replace(filename + ".tmp", filename)
+    return n
+
+
+def _featurize_shard(args):
+    i, shard, filename, kwargs = args
+    n = featurize_shard(shard, filename, **kwargs)
+    return i, n
+
+
+def make_shards(dumps, index=None, streams_per_shard=100):
+    """Split dump files into shards.
+
+    If ``index`` is given, ``dumps`` must be a single multistream dump, which
+    is split into shards of ``streams_per_shard`` bz2 streams. Otherwise each
+    dump file is a shard.
+    """
+    if index is None:
+        return [("file", f) for f in dumps]
+    if len(dumps) != 1:
+        raise ValueError("--index requires exactly one multistream dump")
+    offsets = read_multistream_index(index)
+    return [
+        ("multistream", (dumps[0], chunk))
+        for chunk in split_seq(offsets, streams_per_shard)
+    ]
+
+
+def run(
+    dumps,
+    output_dir,
+    index=None,
+    n_jobs=1,
+    word_counter="spacy",
+    streams_per_shard=100,
+    batch_size=1000,
+    namespaces=(0,),
+):
+    """Featurize the revisions in ``dumps`` and write them to ``output_dir``."""
+    os.makedirs(output_dir, exist_ok=True)
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() + 1 + n_jobs
+    shards = make_shards(dumps, index=index, streams_per_shard=streams_per_shard)
+    kwargs = {
+        "word_counter": word_counter,
+        "batch_size": batch_size,
+        "namespaces": namespaces,
+    }
+    tasks = []
+    for i, shard in enumerate(shards):
+        filename = os.path.join(output_dir, f"part-{i:05d}.parquet")
+        if not os.path.exists(filename):
+            tasks.append((i, shard, filename, kwargs))
+    logger.info(f"Featurizing {len(tasks)} of {len(shards)} shards")
+
+    n = 0
+    if n_jobs > 1:
+        with Pool(n_jobs) as pool:
+            for done, (i, n_shard) in enumerate(
+                pool.imap_unordered(_featurize_shard, tasks), 1
+            ):
+                n += n_shard
+                logger.info(f"Finished shard {i} ({done}/{len(tasks)}): {n} revisions")
+    else:
+        for done, task in enumerate(tasks, 1):
+            i, n_shard = _featurize_shard(task)
+            n += n_shard
+            logger.info(f"Finished shard {i} ({done}/{len(tasks)}): {n} revisions")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dumps", nargs="+", help="XML dump files")
+    parser.add_argument("output", help="Directory for the Parquet files")
+    parser.add_argument("--index", help="Index of a multistream dump")
+    parser.add_argument("-j", "--n-jobs", type=int, default=1)
+    parser.add_argument("--word-counter", choices=WORD_COUNTERS, default="spacy")
+    parser.add_argument(
+        "--streams-per-shard",
+        type=int,
+        default=100,
+        help="Number of bz2 streams of a multistream dump in each shard",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Revisions per row group"
+    )
+    parser.add_argument(
+        "--namespace",
+        type=int,
+        action="append",
+        dest="namespaces",
+        help="Namespaces to featurize (default: 0)",
+    )
+    args = parser.parse_args()
+    run(
+        args.dumps,
+        args.output,
+        index=args.index,
+        n_jobs=args.n_jobs,
+        word_counter=args.word_counter,
+        streams_per_shard=args.streams_per_shard,
+        batch_size=args.batch_size,
+        namespaces=tuple(args.namespaces or (0,)),
+    )
+
+
+if __name__ == "__main__":
+    main()
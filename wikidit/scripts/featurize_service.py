@@ -0,0 +1,58 @@
+"""Run the featurization and scoring service for the web app.
+
+See :mod:`wikidit.service`. Set ``WIKIDIT_SERVICE_AUTHKEY`` to require
+clients to have that key, and start the app with ``WIKIDIT_SERVICE`` set to
+the path of the socket.
+"""
+import argparse
+import logging
+import os
+
+from ..preprocessing import WORD_COUNTERS
+from ..service import FeaturizeService
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("socket", help="Path of the Unix socket")
+    parser.add_argument(
+        "-j", "--n-workers", type=int, help="Featurization processes (default: CPUs)"
+    )
+    parser.add_argument("--word-counter", choices=WORD_COUNTERS, default="spacy")
+    parser.add_argument(
+        "--max-bytes", type=int, help="Featurize larger revisions approximately"
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="Featurize revisions approximately after this many seconds, "
+        "checked after parsing",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=2,
+        help="Milliseconds to wait for concurrent requests to score together",
+    )
+    parser.add_argument(
+        "--max-batch-rows", type=int, default=1024, help="Largest batch to wait for"
+    )
+    args = parser.parse_args()
+    authkey = os.environ.get("WIKIDIT_SERVICE_AUTHKEY")
+    FeaturizeService(
+        args.socket,
+        n_workers=args.n_workers,
+        word_counter=args.word_counter,
+        max_bytes=args.max_bytes,
+        time_budget=args.time_budget,
+        authkey=authkey.encode() if authkey else None,
+        max_wait=args.max_wait_ms / 1000,
+        max_rows=args.max_batch_rows,
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Predict the quality of the current revisions of Wikipedia pages."""
+import argparse
+import json
+import logging
+
+from ..models import get_model, score_titles
+from ..preprocessing import WORD_COUNTERS
+from ..utils import split_seq
+
+logger = logging.getLogger(__name__)
+
+
+def run(input_file, output_file, n_jobs=1, word_counter="spacy", chunksize=1000):
+    """Score the titles in ``input_file``, one per line, and write NDJSON."""
+    titles = (line.strip() for line in input_file)
+    model = get_model()
+    for i, chunk in enumerate(split_seq((t for t in titles if t), chunksize)):
+        logger.info(f"Scoring chunk {i} ({len(chunk)} titles)")
+        for result in score_titles(
+            chunk, model, n_jobs=n_jobs, word_counter=word_counter
+        ):
+            output_file.write(json.dumps(result) + "\n")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", type=argparse.FileType("r"))
+    parser.add_argument("output", type=argparse.FileType("w"))
+    parser.add_argument("-j", "--n-jobs", type=int, default=1)
+    parser.add_argument("--word-counter", choices=WORD_COUNTERS, default="spacy")
+    args = parser.parse_args()
+    run(args.input, args.output, n_jobs=args.n_jobs, word_counter=args.word_counter)
+
+
+if __name__ == "__main__":
+    main()
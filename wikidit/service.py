@@ -0,0 +1,305 @@
+"""Featurize and score revisions in a pool of processes shared by app workers.
+
+Each worker of the web app otherwise loads its own model, spaCy pipeline,
+and backlog tables, and featurizes pages itself. The service runs one pool
+of featurization processes per host and holds the only copy of the model,
+so the web workers only wait on the MediaWiki API and the service. Run it
+with
+
+    python -m wikidit.scripts.featurize_service /tmp/wikidit.sock -j 4
+
+and start the app with ``WIKIDIT_SERVICE=/tmp/wikidit.sock``.
+
+Requests are sent over a Unix socket with :mod:`multiprocessing.connection`.
+Messages are pickled, so the socket must only be accessible to the user of
+the app, and an ``authkey`` should be set if other users share the host.
+
+The pool processes featurize the pages and apply the edits, and the rows of
+concurrent requests are scored together by a :class:`MicroBatcher`, with one
+``predict_proba`` call.
+"""
+import logging
+import os
+import stat
+import threading
+from multiprocessing import Pool
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .batching import MicroBatcher
+from .models import (
+    RevisionPreprocessor,
+    _add_predictions,
+    _predict_rows,
+    _revision_vector,
+    get_model,
+    get_model_version,
+    page_edit_results,
+    page_edit_rows,
+)
+from .preprocessing import Featurizer, get_backlog_table, get_nlp
+
+logger = logging.getLogger(__name__)
+
+RESULT_KEYS = ("prob", "score", "top_edits", "best", "approximate")
+"""Keys of the results of :func:`wikidit.models.predict_page_edits` returned."""
+
+
+class ServiceError(RuntimeError):
+    """An error raised by the service while handling a request."""
+
+
+# Featurizers of each pool process, created by _init_worker
+_featurizers: Dict[bool, Featurizer] = {}
+
+
+def _init_worker(word_counter: str, max_bytes: Optional[int], time_budget) -> None:
+    _featurizers[False] = Featurizer(
+        word_counter=word_counter, max_bytes=max_bytes, time_budget=time_budget
+    )
+    _featurizers[True] = Featurizer(word_counter=word_counter, max_bytes=0)
+    get_nlp()
+    get_backlog_table()
+
+
+def _page_rows(content: str, approximate: bool) -> Tuple[np.ndarray, bool]:
+    return page_edit_rows(content, _featurizers[approximate])
+
+
+def _revision_rows(contents: List[str]) -> Tuple[List[Dict], np.ndarray]:
+    revisions = []
+    for content in contents:
+        revision = _featurizers[False].parse_content(content)
+        del revision["text"]
+        revisions.append(revision)
+    rows = np.array([_revision_vector(x) for x in revisions], dtype=np.float32)
+    return revisions, rows.reshape(-1, len(RevisionPreprocessor.INPUT_COLS))
+
+
+class FeaturizeService:
+    """Serve featurization and scoring requests on a Unix socket.
+
+    Parameters
+    -----------
+    address:
+        Path of the Unix socket.
+    n_workers:
+        Number of featurization processes. Defaults to the number of CPUs.
+    model:
+        The quality prediction model. If ``None``, the trained model is used.
+    model_version:
+        Version of ``model`` returned by :meth:`version`. Defaults to the hash
+        of the trained model if ``model`` is ``None``, and to ``"custom"``
+        otherwise.
+    word_counter, max_bytes, time_budget:
+        Options of the :class:`Featurizer` of each process.
+    authkey:
+        Key which clients must have to connect.
+    chunksize:
+        Revisions featurized by each task of a bulk request.
+    max_wait, max_rows:
+        Options of the :class:`MicroBatcher` which batches the rows of
+        concurrent requests.
+
+    """
+
+    def __init__(
+        self,
+        address: str,
+        n_workers: Optional[int] = None,
+        model=None,
+        model_version: Optional[str] = None,
+        word_counter: str = "spacy",
+        max_bytes: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        authkey: Optional[bytes] = None,
+        chunksize: int = 10,
+        max_wait: float = 0.002,
+        max_rows: int = 1024,
+    ) -> None:
+        self.address = address
+        self.n_workers = n_workers or os.cpu_count() or 1
+        if model is None:
+            model = get_model()
+            model_version = model_version or get_model_version()
+        self.model = model
+        self.model_version = model_version or "custom"
+        self.featurizer_options = (word_counter, max_bytes, time_budget)
+        self.authkey = authkey
+        self.chunksize = chunksize
+        self._batcher = MicroBatcher(
+            lambda rows: _predict_rows(rows, self.model),
+            max_wait=max_wait,
+            max_rows=max_rows,
+        )
+        self._pool = None
+        self._listener = None
+        self._shutdown = False
+
+    def version(self) -> str:
+        """Version of the model and featurizer, which predictions depend on."""
+        featurizer = Featurizer(*self.featurizer_options)
+        return f"{self.model_version}-{featurizer.version}"
+
+    def predict(self, content: str, approximate: bool = False) -> Dict:
+        """Predict the quality and edits of the content of a revision."""
+        rows, approximate = self._pool.apply(_page_rows, (content, approximate))
+        probs = self._batcher(rows)
+        result = page_edit_results(rows, probs, self.model, approximate)
+        return {k: result[k] for k in RESULT_KEYS}
+
+    def score_revisions(self, contents: List[str]) -> pd.DataFrame:
+        """Score many revisions, like :func:`wikidit.models.score_revisions`."""
+        if not contents:
+            return pd.DataFrame()
+        chunks = [
+            contents[i : i + self.chunksize]
+            for i in range(0, len(contents), self.chunksize)
+        ]
+        revisions = []
+        rows = []
+        for chunk_revisions, chunk_rows in self._pool.imap(_revision_rows, chunks):
+            revisions.extend(chunk_revisions)
+            rows.append(chunk_rows)
+        probs = self._batcher(np.concatenate(rows))
+        return _add_predictions(pd.DataFrame.from_records(revisions), self.model, probs)
+
+    def _handle(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if method == "version":
+                        response = ("ok", self.version())
+                    elif method == "predict":
+                        response = ("ok", self.predict(*args))
+                    elif method == "score_revisions":
+                        response = ("ok", self.score_revisions(*args))
+                    else:
+                        response = ("error", f"Unknown method {method!r}")
+                except Exception as e:
+                    logger.exception(f"Error handling {method}")
+                    response = ("error", repr(e))
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self) -> None:
+        """Accept connections until interrupted or :meth:`shutdown` is called.
+
+        A socket left at ``address`` by a previous run is replaced, but any
+        other file there raises ``FileExistsError``.
+        """
+        self._remove_socket()
+        # Load the NLP pipeline and backlog tables before forking the pool, so
+        # the processes share them
+        get_nlp()
+        get_backlog_table()
+        self._pool = Pool(
+            self.n_workers, initializer=_init_worker, initargs=self.featurizer_options
+        )
+        # Only the user of the service can connect to the socket
+        umask = os.umask(0o077)
+        try:
+            self._listener = Listener(self.address, "AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        logger.info(f"Serving on {self.address} with {self.n_workers} processes")
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except Exception as e:
+                    if self._shutdown:
+                        break
+                    # e.g. a client with the wrong authkey
+                    logger.warning(f"Rejected connection: {e!r}")
+                    continue
+                if self._shutdown:
+                    conn.close()
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+            self._pool.terminate()
+
+    def _remove_socket(self) -> None:
+        """Remove the socket left by a previous run of the service."""
+        try:
+            mode = os.lstat(self.address).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{self.address} exists and is not a socket")
+        os.remove(self.address)
+
+    def shutdown(self) -> None:
+        """Stop :meth:`serve_forever`, which runs in another thread."""
+        self._shutdown = True
+        # Wake up the thread waiting for a connection
+        try:
+            Client(self.address, "AF_UNIX", authkey=self.authkey).close()
+        except (EOFError, OSError):
+            pass
+
+
+class ServiceClient:
+    """Client of a :class:`FeaturizeService`.
+
+    Each thread, and each process, opens its own connection on first use.
+
+    Parameters
+    -----------
+    address:
+        Path of the Unix socket of the service.
+    authkey:
+        Key of the service.
+
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None) -> None:
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # Connections cannot be shared with forked processes
+        if conn is None or self._local.pid != os.getpid():
+            conn = Client(self.address, "AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _call(self, method: str, *args):
+        conn = self._connection()
+        try:
+            conn.send((method, args))
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            # Reconnect on the next call, e.g. after the service restarts
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise ServiceError(value)
+        return value
+
+    def version(self) -> str:
+        """Version of the model and featurizer of the service."""
+        return self._call("version")
+
+    def predict(self, content: str, approximate: bool = False) -> Dict:
+        """Predict the quality and edits of the content of a revision."""
+        return self._call("predict", content, approximate)
+
+    def score_revisions(self, contents: List[str]) -> pd.DataFrame:
+        """Score many revisions, like :func:`wikidit.models.score_revisions`."""
+        return self._call("score_revisions", contents)
+
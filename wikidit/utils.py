@@ -1,4 +1,7 @@
+import collections
 import itertools
+import threading
+from functools import wraps
 
 
 def split_seq(iterable, size):
@@ -8,3 +11,59 @@ def split_seq(iterable, size):
     while item:
         yield item
         item = list(itertools.islice(it, size))
+
+
+def lazy(func):
+    """Only call ``func`` once, on first use, and cache the result.
+
+    This is used for expensive objects such as the model and the NLP pipeline
+    which should not be loaded at import time. ``func`` cannot take any
+    arguments. It is safe to call the decorated function from multiple threads.
+    """
+    lock = threading.Lock()
+    result = []
+
+    @wraps(func)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(func())
+        return result[0]
+
+    return wrapper
+
+
+def imap_bounded(func, iterable, pool=None, max_pending=None):
+    """Lazily map ``func`` over ``iterable`` in a process pool, in order.
+
+    Unlike :meth:`multiprocessing.pool.Pool.imap`, which consumes the whole
+    iterable up front, at most ``max_pending`` items are submitted to the
+    pool but not yet yielded, so memory use stays bounded.
+
+    Parameters
+    -----------
+    func:
+        Function to apply. It must be picklable.
+    iterable:
+        Items to apply ``func`` to.
+    pool: multiprocessing.pool.Pool, optional
+        The process pool. If ``None``, ``func`` is applied in this process.
+    max_pending: int, optional
+        Maximum number of items in the pool, e.g. twice its number of
+        processes. Required if ``pool`` is given.
+
+    """
+    if pool is None:
+        for item in iterable:
+            yield func(item)
+        return
+    if max_pending is None:
+        raise ValueError("max_pending is required with a pool")
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()